@@ -0,0 +1,115 @@
+"""
+Cost and accuracy of STFT analysis plans (metric/distance/chromagram.py).
+
+Every plan (analysis rate, fast FFT length) is compared with the current
+settings (44.1 kHz, 33207-sample frames): STFT time (resampling
+included), total chroma time, and how far its chromagram and labels are
+from the reference. Frames are matched by time with each plan's own
+hop_seconds(), since the hop is rounded at the analysis rate.
+
+    python benchmarks/analysis_plan.py                 # 120 s of synthesized chords
+    python benchmarks/analysis_plan.py song.wav --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "metric"))
+sys.path.insert(0, ROOT)
+
+from distance.recognition import (
+    AnalysisPlan,
+    chord_recognition_from_chromagram,
+    chromagram_stft,
+    load_audio,
+    stft_power,
+)
+from suite import SR, synthesize_chords
+
+PLANS = [
+    AnalysisPlan(),
+    AnalysisPlan(fast_fft=True),
+    AnalysisPlan(analysis_sr=22050),
+    AnalysisPlan(analysis_sr=22050, fast_fft=True),
+    AnalysisPlan(analysis_sr=11025),
+    AnalysisPlan(analysis_sr=11025, fast_fft=True),
+]
+
+
+def best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def stft_only(y, plan):
+    y, sr = plan.resample(y, SR)
+    _, win_length, n_fft, hop_length = plan.sizes(sr)
+    return stft_power(y, n_fft, hop_length, win_length=win_length)
+
+
+def align(C, hop, ref_frames, ref_hop):
+    # frame of C nearest in time to every reference frame
+    j = np.rint(np.arange(ref_frames) * ref_hop / hop).astype(int)
+    return C[:, np.clip(j, 0, C.shape[1] - 1)]
+
+
+def compare(C, ref):
+    cos = np.sum(C * ref, axis=0) / np.maximum(
+        np.linalg.norm(C, axis=0) * np.linalg.norm(ref, axis=0), 1e-12
+    )
+    return np.abs(C - ref).sum(axis=0).mean(), cos.mean()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*", help="Audio files (default: synthesized chords)")
+    parser.add_argument("--seconds", type=float, default=120,
+                        help="Length of the synthesized audio when no file is given")
+    parser.add_argument("--repeat", "-r", type=int, default=3)
+    args = parser.parse_args()
+
+    signals = [(path, load_audio(path, sr=SR)[0]) for path in args.files]
+    if not signals:
+        signals = [(f"synthesized {args.seconds:g} s", synthesize_chords(args.seconds))]
+
+    # the first librosa calls pay numba compilation; keep it out of the timings
+    for plan in PLANS:
+        chromagram_stft(synthesize_chords(2), SR, plan=plan)
+
+    for name, y in signals:
+        print(f"\n{name}")
+        print(f"{'rate':>6s} {'fft':>5s} {'n_fft':>6s} {'hop s':>9s} {'stft':>9s} {'chroma':>9s} "
+              f"{'speedup':>8s} {'|dC|':>7s} {'cos':>7s} {'labels':>7s}")
+
+        ref = None
+        for plan in PLANS:
+            rate, _, n_fft, _ = plan.sizes(SR)
+            hop = plan.hop_seconds(SR)
+
+            t_stft, _ = best_of(lambda: stft_only(y, plan), args.repeat)
+            t_total, C = best_of(lambda: chromagram_stft(y, SR, plan=plan), args.repeat)
+            labels = chord_recognition_from_chromagram(C)
+
+            if ref is None:
+                ref = (C, hop, labels, t_stft)
+            ref_C, ref_hop, ref_labels, ref_stft = ref
+
+            aligned = align(C, hop, ref_C.shape[1], ref_hop)
+            diff, cos = compare(aligned, ref_C)
+            aligned_labels = align(np.array([labels]), hop, len(ref_labels), ref_hop)[0]
+            agreement = np.mean(aligned_labels == np.array(ref_labels))
+
+            print(f"{rate:6d} {'fast' if plan.fast_fft else '-':>5s} {n_fft:6d} {hop:9.6f} "
+                  f"{t_stft * 1000:7.1f}ms {t_total * 1000:7.1f}ms {ref_stft / t_stft:7.1f}x {diff:7.4f} {cos:7.4f} {agreement:7.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Microbenchmark for the offline filters in metric/distance/filters.py.
+
+Times every filter on a random K x N distance matrix (float64 and
+float32) next to the distance computation it follows, so the filtering
+stage can be checked against the scoring stage.
+
+    python benchmarks/filters.py --frames 40000 --repeat 5
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "metric"))
+sys.path.insert(0, ROOT)
+
+from distance.recognition import (
+    compute_distance_matrix,
+    generate_all_templates,
+    low_pass_filter,
+    low_pass_median_filter,
+    median_filter,
+    median_filter_offline,
+)
+
+
+def best_of(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--frames", "-n", type=int, default=40000)
+    parser.add_argument("--repeat", "-r", type=int, default=5)
+    parser.add_argument("--L", type=int, default=17)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    C = rng.random((12, args.frames))
+    C /= C.sum(axis=0, keepdims=True)
+
+    templates = generate_all_templates(1)
+    P = np.stack(list(templates.values()))
+
+    print(f"K={P.shape[0]} N={args.frames} L={args.L}")
+    for measure in ("EUC", "KL2"):
+        t = best_of(lambda: compute_distance_matrix(C, P, measure), args.repeat)
+        print(f"{'distance ' + measure:28s} {t * 1000:9.2f} ms")
+
+    D64 = compute_distance_matrix(C, P, "KL2")
+    for D in (D64, D64.astype(np.float32)):
+        out = np.empty_like(D)
+        cases = {
+            "low_pass_filter": lambda: low_pass_filter(D, args.L, out=out),
+            "median_filter_offline": lambda: median_filter_offline(D, args.L, out=out),
+            "median_filter": lambda: median_filter(D, args.L, out=out),
+            "low_pass_median_filter": lambda: low_pass_median_filter(D, 5, args.L, out=out),
+        }
+        for name, func in cases.items():
+            t = best_of(func, args.repeat)
+            print(f"{name + ' ' + str(D.dtype):28s} {t * 1000:9.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Startup-time report for the command-line entry points.
+
+Every entry point is started in a fresh interpreter under
+`python -X importtime`, and the wall time plus the most expensive
+top-level imports are reported:
+
+    python benchmarks/startup.py                       # --help of every entry point
+    python benchmarks/startup.py --entry metric hmm --args --file song.wav
+    python benchmarks/startup.py --repeat 5 --top 15
+
+An entry point that fails to start (e.g. a missing optional dependency)
+is reported with the last line of its stderr.
+"""
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+ENTRY_POINTS = {
+    "metric": "metric/main.py",
+    "template": "metric/librosa_lib.py",
+    "hmm": "probabilistic/librosa_lib.py",
+    "madmom": "neural/main.py",
+    "omnizart": "neural/omny.py",
+}
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def run_entry(script, args):
+    path = os.path.join(ROOT, script)
+    start = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", path, *args],
+        cwd=os.path.dirname(path),
+        capture_output=True,
+        text=True
+    )
+    wall = time.perf_counter() - start
+    return wall, proc.returncode, proc.stderr
+
+
+def parse_importtime(stderr):
+    # top-level imports only: their cumulative time includes the children
+    imports = []
+    for line in stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match and len(match.group(3)) == 1:
+            imports.append((int(match.group(2)) / 1e6, match.group(4)))
+    return imports
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--entry", nargs="+", choices=sorted(ENTRY_POINTS), default=sorted(ENTRY_POINTS))
+    parser.add_argument("--args", nargs=argparse.REMAINDER, default=["--help"],
+                        help="Arguments passed to every entry point (default: --help)")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per entry point; the fastest is reported")
+    parser.add_argument("--top", type=int, default=10, help="Number of imports to list")
+    args = parser.parse_args()
+
+    for name in args.entry:
+        runs = [run_entry(ENTRY_POINTS[name], args.args) for _ in range(args.repeat)]
+        wall, returncode, stderr = min(runs, key=lambda run: run[0])
+
+        print(f"\n{name} ({ENTRY_POINTS[name]} {' '.join(args.args)})")
+
+        if returncode != 0:
+            errors = [line for line in stderr.splitlines() if not line.startswith("import time:")]
+            print(f"  failed (exit {returncode}): {errors[-1] if errors else ''}")
+            continue
+
+        imports = parse_importtime(stderr)
+        print(f"  wall {wall:.3f} s, imports {sum(t for t, _ in imports):.3f} s")
+        for seconds, module in sorted(imports, reverse=True)[:args.top]:
+            print(f"  {seconds:8.3f} s  {module}")
+
+
+if __name__ == "__main__":
+    main()
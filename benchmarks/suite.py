@@ -0,0 +1,229 @@
+"""
+Benchmark suite for every stage of the recognition pipeline.
+
+Audio is synthesized (summed sinusoids with decaying harmonics, one
+random major/minor chord every two seconds), so no dataset or
+microphone is needed. For each length every stage is timed separately
+and the real-time factor (stage seconds / audio seconds) and the peak
+traced memory are reported. Results are written as JSON and can be
+compared with a stored baseline:
+
+    python benchmarks/suite.py --lengths 2 30 300 --out bench.json
+    python benchmarks/suite.py --baseline bench.json --threshold 0.2
+
+Exit status is 1 when a stage got slower than the baseline by more
+than the threshold.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import librosa
+import numpy as np
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, os.path.join(ROOT, "metric"))
+sys.path.insert(0, ROOT)
+
+from distance.recognition import (
+    chord_recognition,
+    chromagram_cqt,
+    chromagram_stft,
+    get_template_bank,
+    low_pass_filter,
+    low_pass_median_filter,
+    median_filter,
+    median_filter_offline,
+    recognize_chords_framewise,
+)
+
+SR = 44100
+CHORD_SECONDS = 2.0
+
+ROOT_FREQS = 261.63 * 2 ** (np.arange(12) / 12)
+
+
+def synthesize_chords(seconds, sr=SR, num_harmonics=3, seed=0):
+    """
+    Chord audio as float32: a random major or minor triad every
+    CHORD_SECONDS, each note with num_harmonics decaying harmonics.
+    """
+    rng = np.random.default_rng(seed)
+    n = int(seconds * sr)
+    y = np.empty(n, dtype=np.float32)
+    seg = int(CHORD_SECONDS * sr)
+    t = np.arange(seg) / sr
+
+    for start in range(0, n, seg):
+        root = rng.integers(12)
+        third = 4 if rng.random() < 0.5 else 3
+        freqs = ROOT_FREQS[root] * 2 ** (np.array([0, third, 7]) / 12)
+
+        block = np.zeros(seg)
+        for f in freqs:
+            for h in range(1, num_harmonics + 1):
+                block += 0.6 ** (h - 1) * np.sin(2 * np.pi * f * h * t)
+
+        stop = min(start + seg, n)
+        y[start:stop] = block[:stop - start]
+
+    y += 0.01 * rng.standard_normal(n).astype(np.float32)
+    y *= 0.3 / np.abs(y).max()
+    return y
+
+
+def load_hmm_module():
+    path = os.path.join(ROOT, "probabilistic", "librosa_lib.py")
+    spec = importlib.util.spec_from_file_location("hmm_librosa_lib", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure(func, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    # separate traced run so tracing overhead does not skew timings
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return best, peak
+
+
+def build_stages(y, wav_path, hmm):
+    state = {}
+
+    def stft():
+        state["C"] = chromagram_stft(y, SR)
+
+    stages = [
+        ("compute_chromagram_stft", stft),
+        ("compute_chromagram_cqt", lambda: chromagram_cqt(y, SR)),
+    ]
+
+    bank = get_template_bank("majmin", 1)
+    for m in ("EUC", "KL2"):
+        def score(m=m):
+            state["D"] = recognize_chords_framewise(state["C"], bank, m)[1]
+        stages.append((f"recognize_chords_framewise[{m}]", score))
+
+    stages += [
+        ("low_pass_filter", lambda: low_pass_filter(state["D"], 17)),
+        ("median_filter_offline", lambda: median_filter_offline(state["D"], 17)),
+        ("median_filter", lambda: median_filter(state["D"], 17)),
+        ("low_pass_median_filter", lambda: low_pass_median_filter(state["D"], 5, 17)),
+    ]
+
+    if hmm is not None:
+        chroma = hmm.extract_chroma(librosa.resample(y, orig_sr=SR, target_sr=hmm.SR))
+        emission = hmm.compute_emission(chroma)
+        stages.append(("viterbi", lambda: hmm.viterbi(emission)))
+
+    stages.append(("chord_recognition", lambda: chord_recognition(wav_path)))
+    return stages
+
+
+def run(lengths, repeat):
+    import soundfile as sf
+
+    try:
+        hmm = load_hmm_module()
+    except (ImportError, OSError) as e:
+        # OSError: sounddevice without the PortAudio library
+        print(f"viterbi skipped: {e}")
+        hmm = None
+
+    results = {}
+    for seconds in lengths:
+        y = synthesize_chords(seconds)
+
+        with tempfile.TemporaryDirectory() as tmp:
+            wav_path = os.path.join(tmp, "bench.wav")
+            sf.write(wav_path, y, SR)
+
+            for name, func in build_stages(y, wav_path, hmm):
+                # short inputs are repeated more to get stable timings
+                t, peak = measure(func, repeat if seconds >= 60 else repeat * 3)
+                key = f"{name}@{seconds:g}s"
+                results[key] = {
+                    "stage": name,
+                    "audio_seconds": seconds,
+                    "seconds": t,
+                    "rtf": t / seconds,
+                    "peak_mb": peak / 1024 ** 2,
+                }
+                print(f"{key:45s} {t * 1000:10.2f} ms  rtf {t / seconds:9.5f}  peak {peak / 1024 ** 2:9.1f} MB")
+
+    return results
+
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for key, r in results.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        ratio = r["seconds"] / base["seconds"]
+        if ratio > 1 + threshold:
+            regressions.append((key, base["seconds"], r["seconds"], ratio))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=float, nargs="+", default=[2, 30, 300],
+                        help="Audio lengths in seconds (e.g. 2 30 300 3600)")
+    parser.add_argument("--repeat", "-r", type=int, default=3)
+    parser.add_argument("--out", "-o", help="Write results as JSON")
+    parser.add_argument("--baseline", "-b", help="Baseline JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed relative slowdown before flagging a regression")
+    args = parser.parse_args()
+
+    # the first librosa calls pay numba compilation; keep it out of the timings
+    chromagram_stft(synthesize_chords(2), SR)
+
+    results = run(args.lengths, args.repeat)
+
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "machine": platform.machine(),
+            "processor": platform.processor(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print("Results written to", os.path.abspath(args.out))
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        regressions = compare(results, baseline, args.threshold)
+        for key, before, after, ratio in regressions:
+            print(f"REGRESSION {key}: {before * 1000:.2f} ms -> {after * 1000:.2f} ms ({ratio:.2f}x)")
+        if regressions:
+            sys.exit(1)
+        print("No regressions against", args.baseline)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+import os
+from functools import lru_cache
+
+import numpy as np
+
+from common.instrumentation import stage
+
+# Spectral-to-chroma projections and CQT kernels are built once per
+# setting and shared read-only: in realtime mode every hop used to
+# rebuild them inside librosa. librosa is imported only where a kernel is
+# built, since librosa.filters pulls in scipy.signal and numba (seconds on
+# a cold start).
+
+
+@lru_cache(maxsize=64)
+def chroma_filterbank(sr, n_fft, tuning=0.0, n_chroma=12):
+    """
+    librosa.filters.chroma, shape (n_chroma, 1 + n_fft // 2).
+    """
+    import librosa
+
+    fb = librosa.filters.chroma(sr=sr, n_fft=n_fft, tuning=tuning, n_chroma=n_chroma)
+    fb.flags.writeable = False
+    return fb
+
+
+def power_to_chroma(S, sr, tuning=None, n_fft=None):
+    """
+    librosa.feature.chroma_stft(S=S, sr=sr, tuning=tuning) as a single
+    product with a cached filter bank.
+    S: shape (1 + n_fft // 2, N) — power spectrogram
+    n_fft: defaults to 2 * (bins - 1), what chroma_stft infers from S
+    tuning: a value, a TuningTracker, or None to estimate it from S
+    like chroma_stft
+    """
+    if n_fft is None:
+        n_fft = 2 * (S.shape[0] - 1)
+
+    if tuning is None:
+        tuning = tuning_from_peaks([tuning_peaks(S, sr)])
+    elif isinstance(tuning, TuningTracker):
+        tuning = tuning.update(S, sr)
+
+    return max_normalize(chroma_filterbank(sr, n_fft, float(tuning)) @ S)
+
+
+def tuning_peaks(S, sr):
+    """
+    Spectral peaks (frequencies, magnitudes) librosa.estimate_tuning
+    uses, for a block of power spectrogram frames. Peaks are found frame
+    by frame, so blocks of one signal can be analyzed separately and
+    combined with tuning_from_peaks().
+    """
+    import librosa
+
+    pitches, mags = librosa.piptrack(S=S, sr=sr)
+    mask = pitches > 0
+    return pitches[mask], mags[mask]
+
+
+def tuning_from_peaks(peaks):
+    """
+    Same value as librosa.estimate_tuning(S=S) for the concatenation of
+    the blocks the peaks came from (chroma_stft's bins_per_octave=12).
+    """
+    import librosa
+
+    pitches = np.concatenate([p for p, _ in peaks])
+    mags = np.concatenate([m for _, m in peaks])
+
+    threshold = np.median(mags) if len(mags) else 0.0
+    return librosa.pitch_tuning(pitches[mags >= threshold], bins_per_octave=12)
+
+
+class TuningTracker:
+    """
+    Tuning (deviation from A440 in fractions of a chroma bin) kept for a
+    whole file or stream instead of being re-estimated on every call.
+
+    The first update() estimates it from the given power spectrogram,
+    exactly like chroma_stft would. With rate=0 that value is kept; with
+    rate > 0 every later update() moves it by that fraction towards the
+    estimate of the new frames, so a stream follows slow drifts without
+    the frame-to-frame jitter of per-call estimates. The average is taken
+    on the circle (tuning wraps at +-0.5 bin) and rounded to `resolution`
+    so the cached filter banks are reused. Blocks with fewer than
+    min_peaks spectral peaks (silence) are ignored.
+
+    force=True re-estimates from scratch on every update, i.e. the
+    per-call behavior of librosa.
+    """
+
+    def __init__(self, rate=0.0, resolution=0.01, min_peaks=32, force=False):
+        self.rate = rate
+        self.resolution = resolution
+        self.min_peaks = min_peaks
+        self.force = force
+        self.reset()
+
+    def reset(self):
+        self.tuning = None
+        self.updates = 0
+        self._phase = None
+
+    @property
+    def settled(self):
+        # a kept estimate that no update would change
+        return self.tuning is not None and self.rate == 0 and not self.force
+
+    def update(self, S, sr):
+        if self.settled:
+            return self.tuning
+        return self.update_from_peaks([tuning_peaks(S, sr)])
+
+    def update_from_peaks(self, peaks):
+        """
+        update() from the tuning_peaks() of one or more blocks, e.g. the
+        chunks of chord_recognition_parallel().
+        """
+        if self.settled:
+            return self.tuning
+
+        n_peaks = sum(len(p) for p, _ in peaks)
+        if self.tuning is not None and n_peaks < self.min_peaks and not self.force:
+            return self.tuning
+
+        estimate = tuning_from_peaks(peaks)
+        self.updates += 1
+
+        if self.tuning is None or self.force:
+            self.tuning = estimate
+            self._phase = np.exp(2j * np.pi * estimate)
+        else:
+            self._phase = (1 - self.rate) * self._phase + self.rate * np.exp(2j * np.pi * estimate)
+            tuning = np.angle(self._phase) / (2 * np.pi)
+            self.tuning = round(tuning / self.resolution) * self.resolution
+        return self.tuning
+
+    def update_from_signal(self, y, sr, n_fft=2048):
+        # for paths without an STFT of their own (CQT): the magnitude
+        # spectrogram librosa.estimate_tuning(y=y) would use
+        if self.settled:
+            return self.tuning
+
+        import librosa
+
+        return self.update(np.abs(librosa.stft(y, n_fft=n_fft)), sr)
+
+
+# update rate of per-stream trackers: with 0.5 s hops the estimate
+# follows a tuning change within ~10 s
+STREAM_TUNING_RATE = 0.05
+
+@lru_cache(maxsize=64)
+def _file_tracker(key):
+    return TuningTracker()
+
+
+def file_tuning(audio_path, analysis, force=False):
+    """
+    The TuningTracker (rate=0) of one audio file and analysis, shared by
+    every chroma computation on it in this process; keyed by path, size,
+    mtime and `analysis`, a hashable description of the spectrogram the
+    estimate comes from (e.g. ("STFT", sr, n_fft, ...)), so analyses
+    with different spectrograms never see each other's estimate.
+    force=True discards the stored estimate.
+    """
+    st = os.stat(audio_path)
+    key = (os.path.abspath(audio_path), st.st_size, st.st_mtime_ns, analysis)
+
+    tracker = _file_tracker(key)
+    if force:
+        tracker.reset()
+    return tracker
+
+
+def max_normalize(C):
+    # per-frame max normalization of librosa's chroma features (norm=inf);
+    # all-zero frames are left as they are
+    C /= np.maximum(C.max(axis=0, keepdims=True), np.finfo(C.dtype).tiny)
+    return C
+
+
+class CQTKernel:
+    """
+    Frequency-domain constant-Q basis (librosa's wavelet filters) for all
+    bins at one FFT size, so a CQT is one STFT with a rectangular window
+    and one sparse product. librosa.cqt rebuilds its basis on every call
+    and filters octave by octave; without its downsampling (odd hops) the
+    result agrees with it up to the sparsification of the basis.
+    Obtain kernels through cqt_kernel() so they are built once.
+    """
+
+    def __init__(self, sr, n_bins=84, bins_per_octave=12, tuning=0.0, sparsity=0.01):
+        import librosa
+        from scipy import sparse
+
+        fmin = librosa.note_to_hz("C1") * 2.0 ** (tuning / bins_per_octave)
+        freqs = librosa.cqt_frequencies(n_bins=n_bins, fmin=fmin, bins_per_octave=bins_per_octave)
+
+        basis, lengths = librosa.filters.wavelet(freqs=freqs, sr=sr, norm=1, pad_fft=True, window="hann")
+        self.n_fft = basis.shape[1]
+
+        # same normalization as librosa's filter FFT and its scale=True
+        basis *= lengths[:, None] / float(self.n_fft)
+        fft_basis = np.fft.fft(basis, axis=1)[:, :self.n_fft // 2 + 1]
+        fft_basis /= np.sqrt(lengths)[:, None]
+
+        self.basis = sparse.csr_matrix(librosa.util.sparsify_rows(fft_basis, quantile=sparsity))
+        self.sr = sr
+        self.n_bins = n_bins
+        self.bins_per_octave = bins_per_octave
+
+    def transform(self, y, hop_length):
+        """
+        |CQT| of y, shape (n_bins, N), centered frames as librosa.cqt.
+        """
+        import librosa
+
+        D = librosa.stft(y, n_fft=self.n_fft, hop_length=hop_length, window="ones", pad_mode="constant")
+        return np.abs(self.basis @ D)
+
+
+@lru_cache(maxsize=16)
+def cqt_kernel(sr, n_bins=84, bins_per_octave=12, tuning=0.0):
+    return CQTKernel(sr, n_bins, bins_per_octave, tuning)
+
+
+@lru_cache(maxsize=16)
+def cq_to_chroma_matrix(n_bins, bins_per_octave=12, n_chroma=12):
+    import librosa
+
+    M = librosa.filters.cq_to_chroma(n_bins, bins_per_octave=bins_per_octave, n_chroma=n_chroma)
+    M.flags.writeable = False
+    return M
+
+
+class IncrementalChroma:
+    """
+    STFT chroma computed only for newly arrived audio.
+
+    push() appends samples and returns chroma for every frame that became
+    complete, shape (12, M). The trailing samples needed for the next
+    frame's overlap are carried over, so each sample is transformed
+    n_fft / hop_length times in total instead of once per realtime hop
+    for the whole buffer.
+
+    With center=True the stream is treated like librosa.stft(center=True,
+    pad_mode="constant"): n_fft // 2 zeros are prepended, and flush()
+    appends the closing padding. Frames then match librosa.feature.
+    chroma_stft with the same tuning. center=False starts the first frame
+    at the first sample, which avoids the half-window output delay in
+    realtime use.
+
+    tuning is a fixed value or a TuningTracker that is updated with
+    every pushed block. win_length < n_fft zero-pads each window to
+    n_fft (see AnalysisPlan.fast_fft).
+
+    The last `history` frames are kept in `history` for downstream
+    scoring over a longer context.
+    """
+
+    def __init__(self, sr, n_fft, hop_length, tuning=0.0, center=False, history=0, win_length=None):
+        self.sr = sr
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.center = center
+        self.history_frames = history
+
+        # periodic Hann, same as scipy.signal.get_window("hann", win_length),
+        # zero-padded to n_fft in the middle like librosa.stft
+        win_length = win_length or n_fft
+        offset = (n_fft - win_length) // 2
+        self.window = np.zeros(n_fft)
+        self.window[offset:offset + win_length] = 0.5 - 0.5 * np.cos(2 * np.pi * np.arange(win_length) / win_length)
+        self.tuning = tuning
+
+        self.reset()
+
+    def reset(self):
+        pad = self.n_fft // 2 if self.center else 0
+        self._tail = np.zeros(pad, dtype=np.float32)
+        self.frames = 0
+        self.history = np.zeros((12, 0))
+
+    def push(self, samples):
+        buf = np.concatenate([self._tail, np.asarray(samples, dtype=np.float32)])
+
+        n_frames = 0
+        if len(buf) >= self.n_fft:
+            n_frames = 1 + (len(buf) - self.n_fft) // self.hop_length
+
+        self._tail = buf[n_frames * self.hop_length:]
+        if n_frames == 0:
+            return np.zeros((12, 0))
+
+        frames = np.lib.stride_tricks.sliding_window_view(buf, self.n_fft)
+        frames = frames[::self.hop_length][:n_frames]
+
+        with stage("stft", frames=n_frames):
+            S = np.abs(np.fft.rfft(frames * self.window, axis=1)) ** 2
+
+        with stage("chroma", frames=n_frames):
+            C = power_to_chroma(S.T, self.sr, self.tuning, self.n_fft)
+
+        self.frames += n_frames
+        if self.history_frames:
+            self.history = np.concatenate([self.history, C], axis=1)[:, -self.history_frames:]
+
+        return C
+
+    def flush(self):
+        # end of stream: emit the frames whose centers are still pending
+        if not self.center:
+            return np.zeros((12, 0))
+        pending = len(self._tail) - self.n_fft // 2
+        if pending <= 0:
+            return np.zeros((12, 0))
+        n_frames = 1 + (pending - 1) // self.hop_length
+        pad = (n_frames - 1) * self.hop_length + self.n_fft - len(self._tail)
+        return self.push(np.zeros(max(pad, 0), dtype=np.float32))
@@ -0,0 +1,247 @@
+"""
+Per-stage timing and counters for the recognition pipelines.
+
+Code marks its stages with
+
+    with stage("stft", frames=n):
+        ...
+
+While instrumentation is disabled (the default) stage() returns a shared
+no-op context manager, so the cost is one attribute check per stage.
+Once enable()d, every stage records its latency into a log2-bucketed
+histogram together with frame counts and the change in allocated
+Python memory blocks; tracemalloc can additionally report bytes
+allocated per stage. Summaries can be printed on demand or periodically,
+and with trace=True the stage spans are kept for a Chrome trace
+(chrome://tracing, Perfetto) written by dump_chrome_trace().
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+
+class StageStats:
+
+    def __init__(self):
+        self.count = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.frames = 0
+        self.alloc_blocks = 0
+        self.alloc_bytes = 0
+        # bucket b holds latencies in [2^(b-1), 2^b) microseconds
+        self.histogram = {}
+
+    def add(self, ns, frames, blocks, nbytes):
+        self.count += 1
+        self.total_ns += ns
+        self.max_ns = max(self.max_ns, ns)
+        self.frames += frames
+        self.alloc_blocks += blocks
+        self.alloc_bytes += nbytes
+        bucket = (ns // 1000).bit_length()
+        self.histogram[bucket] = self.histogram.get(bucket, 0) + 1
+
+    def percentile(self, q):
+        # upper edge of the bucket containing the q-th percentile, in ms
+        target = q * self.count
+        seen = 0
+        for bucket in sorted(self.histogram):
+            seen += self.histogram[bucket]
+            if seen >= target:
+                return (1 << bucket) / 1000
+        return 0.0
+
+    def as_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total_ns / 1e6,
+            "mean_ms": self.total_ns / 1e6 / self.count if self.count else 0.0,
+            "p50_ms": self.percentile(0.50),
+            "p95_ms": self.percentile(0.95),
+            "p99_ms": self.percentile(0.99),
+            "max_ms": self.max_ns / 1e6,
+            "frames": self.frames,
+            "alloc_blocks": self.alloc_blocks,
+            "alloc_bytes": self.alloc_bytes,
+            "histogram_us": {f"<{1 << b}": n for b, n in sorted(self.histogram.items())},
+        }
+
+
+class _NoopStage:
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class _Stage:
+
+    __slots__ = ("recorder", "name", "frames", "start", "blocks", "nbytes")
+
+    def __init__(self, recorder, name, frames):
+        self.recorder = recorder
+        self.name = name
+        self.frames = frames
+
+    def __enter__(self):
+        self.blocks = sys.getallocatedblocks()
+        self.nbytes = tracemalloc.get_traced_memory()[0] if self.recorder.track_memory else 0
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter_ns()
+        blocks = sys.getallocatedblocks() - self.blocks
+        nbytes = 0
+        if self.recorder.track_memory:
+            nbytes = tracemalloc.get_traced_memory()[0] - self.nbytes
+        self.recorder.record(self.name, self.start, end, self.frames, blocks, nbytes)
+        return False
+
+
+class Recorder:
+
+    def __init__(self):
+        self.enabled = False
+        self.trace = False
+        self.track_memory = False
+        self.reset()
+        self._lock = threading.Lock()
+        self._reporter = None
+
+    def reset(self):
+        self.stages = {}
+        self.counters = {}
+        self.events = deque(maxlen=200000)
+        self.origin_ns = time.perf_counter_ns()
+
+    def record(self, name, start, end, frames=0, blocks=0, nbytes=0):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.add(end - start, frames, blocks, nbytes)
+
+            if self.trace:
+                self.events.append({
+                    "name": name,
+                    "ph": "X",
+                    "ts": (start - self.origin_ns) / 1000,
+                    "dur": (end - start) / 1000,
+                    "pid": os.getpid(),
+                    "tid": threading.get_ident(),
+                    "args": {"frames": frames},
+                })
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def summary(self):
+        with self._lock:
+            return {
+                "stages": {name: s.as_dict() for name, s in self.stages.items()},
+                "counters": dict(self.counters),
+            }
+
+    def format_summary(self):
+        summary = self.summary()
+        lines = [f"{'stage':18s} {'count':>7s} {'mean ms':>9s} {'p95 ms':>8s} {'max ms':>8s} {'frames':>8s} {'blocks':>8s}"]
+        for name, s in sorted(summary["stages"].items(), key=lambda kv: -kv[1]["total_ms"]):
+            lines.append(
+                f"{name:18s} {s['count']:7d} {s['mean_ms']:9.3f} {s['p95_ms']:8.3f} "
+                f"{s['max_ms']:8.3f} {s['frames']:8d} {s['alloc_blocks']:8d}"
+            )
+        for name, value in sorted(summary["counters"].items()):
+            lines.append(f"{name}: {value}")
+        return "\n".join(lines)
+
+    def dump_chrome_trace(self, path):
+        with self._lock:
+            events = list(self.events)
+        with open(path, "w") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+    def start_periodic_summary(self, interval, file=None):
+        self.stop_periodic_summary()
+        stop = threading.Event()
+
+        def report():
+            while not stop.wait(interval):
+                print("\n" + self.format_summary(), file=file or sys.stderr, flush=True)
+
+        thread = threading.Thread(target=report, name="instrumentation-summary", daemon=True)
+        thread.start()
+        self._reporter = (thread, stop)
+
+    def stop_periodic_summary(self):
+        if self._reporter is not None:
+            thread, stop = self._reporter
+            stop.set()
+            thread.join()
+            self._reporter = None
+
+
+_NOOP = _NoopStage()
+
+recorder = Recorder()
+
+
+def enable(trace=False, track_memory=False):
+    recorder.trace = trace
+    recorder.track_memory = track_memory
+    if track_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    recorder.enabled = True
+
+
+def disable():
+    recorder.enabled = False
+    recorder.stop_periodic_summary()
+
+
+def stage(name, frames=0):
+    if not recorder.enabled:
+        return _NOOP
+    return _Stage(recorder, name, frames)
+
+
+def count(name, n=1):
+    if recorder.enabled:
+        recorder.count(name, n)
+
+
+def add_arguments(parser):
+    """
+    --stats / --stats-interval / --trace options shared by the entry points.
+    """
+    parser.add_argument("--stats", action="store_true",
+                        help="Collect per-stage timings and print a summary")
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Also print the summary every N seconds (realtime mode)")
+    parser.add_argument("--trace", metavar="PATH",
+                        help="Write a Chrome trace JSON of all stages to PATH on exit")
+
+
+def configure(args):
+    # --stats-interval implies recording, otherwise it would print empty summaries
+    if args.stats or args.trace or args.stats_interval > 0:
+        enable(trace=bool(args.trace))
+    if args.stats_interval > 0:
+        recorder.start_periodic_summary(args.stats_interval)
+
+
+def finish(args):
+    recorder.stop_periodic_summary()
+    if args.stats or args.stats_interval > 0:
+        print("\n" + recorder.format_summary(), file=sys.stderr)
+    if args.trace:
+        recorder.dump_chrome_trace(args.trace)
+        print(f"Trace written to {os.path.abspath(args.trace)}", file=sys.stderr)
@@ -0,0 +1,114 @@
+import numpy as np
+
+
+class RingBuffer:
+    """
+    Single-producer ring buffer for audio capture.
+
+    The producer (the PortAudio callback) calls write() with each block:
+    two slice copies into a preallocated array, no allocation and no
+    lock. Writes are published like a seqlock: `_started` is advanced to
+    the new total before the copy and `_written` after it. Readers copy
+    up to `_written` and then check `_started`: a write that started
+    meanwhile may have overwritten samples older than _started -
+    capacity, so if the copy reaches back that far it is retried.
+    Consumers never block the producer:
+
+    - latest(n) returns a consistent snapshot of the last n samples.
+    - read_new() returns the samples written since the previous
+      read_new() call and counts the ones that were overwritten before
+      they could be read in `overwritten`.
+
+    This relies on the GIL ordering the counter and data updates (the
+    producer is a Python callback). capacity defaults to twice `size`,
+    so a snapshot of `size` samples only has to be retried when more
+    than `size` samples are written during the copy.
+    """
+
+    def __init__(self, size, capacity=None, dtype=np.float32):
+        self.size = size
+        self.capacity = capacity or 2 * size
+        if self.capacity < size:
+            raise ValueError("capacity must be at least size")
+
+        self._data = np.zeros(self.capacity, dtype=dtype)
+        # total samples whose write has started / completed; only the
+        # producer updates them
+        self._started = 0
+        self._written = 0
+        self._read = 0     # total samples consumed by read_new()
+        self.overwritten = 0
+
+    @property
+    def written(self):
+        return self._written
+
+    def write(self, samples):
+        n = len(samples)
+        cap = self.capacity
+        end = self._written + n
+
+        # announce the write before touching the data
+        self._started = end
+
+        if n > cap:
+            # only the newest `cap` samples can survive anyway
+            samples = samples[n - cap:]
+            n = cap
+
+        start = (end - n) % cap
+        first = min(n, cap - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+
+        # publish only after the data is in place
+        self._written = end
+
+    def latest(self, n=None, out=None):
+        n = self.size if n is None else n
+        if n > self.capacity:
+            raise ValueError("cannot read more than capacity samples")
+        if out is None:
+            out = np.empty(n, dtype=self._data.dtype)
+
+        while True:
+            end = self._written
+            self._copy(end - n, end, out)
+            # no write that started since may have reached the oldest copied sample
+            if self._started - (end - n) <= self.capacity:
+                return out
+
+    def read_new(self):
+        while True:
+            end = self._written
+            start = self._read
+
+            if end - start > self.capacity:
+                self.overwritten += end - self.capacity - start
+                start = end - self.capacity
+
+            out = np.empty(end - start, dtype=self._data.dtype)
+            self._copy(start, end, out)
+
+            if self._started - start <= self.capacity:
+                self._read = end
+                return out
+
+            # the producer lapped the copy; account for it and retry
+            self._read = start
+
+    def _copy(self, start, end, out):
+        cap = self.capacity
+        n = end - start
+
+        if start < 0:
+            # before the first write the buffer holds silence
+            out[:-start] = 0
+            out = out[-start:]
+            start = 0
+            n = end
+
+        i = start % cap
+        first = min(n, cap - i)
+        out[:first] = self._data[i:i + first]
+        out[first:n] = self._data[:n - first]
@@ -0,0 +1,188 @@
+"""
+Deadline-aware driver for the realtime loops.
+
+HopScheduler ticks on a fixed grid of a steady clock (time.perf_counter)
+and hands the analysis to a worker thread, so processing time does not
+push the next hop back and the output cadence stays at `period`. When a
+tick arrives while the previous hop is still running, `policy` decides:
+
+    skip      drop the tick
+    coalesce  keep at most one pending hop; later ticks merge into it
+              (the hop reads all audio captured so far anyway)
+    queue     queue every tick, up to max_queue (the oldest is dropped)
+
+Overruns, PortAudio status flags (xruns) and the latency from capture
+to displayed chord are counted. The audio callback reports each block
+with on_capture(status); `process` returns the displayed label, or None
+when nothing was shown.
+"""
+import threading
+import time
+import traceback
+from collections import deque
+
+from common import instrumentation
+
+POLICIES = ("skip", "coalesce", "queue")
+
+
+class HopScheduler:
+
+    def __init__(self, process, period, policy="coalesce", max_queue=4):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown policy {policy!r}, expected one of {POLICIES}")
+
+        self.process = process
+        self.period = period
+        self.policy = policy
+        self.max_queue = max_queue
+
+        # device-side input latency (stream.latency), added to the capture latency
+        self.input_latency = 0.0
+
+        self._cond = threading.Condition()
+        self._jobs = deque()
+        self._busy = False
+        self._running = False
+        self._worker = None
+        self._last_capture = None
+
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.ticks = 0
+        self.completed = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.late_ticks = 0
+        self.xruns = 0
+        self.errors = 0
+        self.latencies = deque(maxlen=1000)
+        self.durations = deque(maxlen=1000)
+
+    def on_capture(self, status=None):
+        # called from the audio callback after the block was written
+        if status:
+            self.xruns += 1
+            instrumentation.count("xruns")
+        self._last_capture = time.perf_counter()
+
+    def start(self):
+        self._running = True
+        self._worker = threading.Thread(target=self._work, name="hop-worker", daemon=True)
+        self._worker.start()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._jobs.clear()
+            self._cond.notify()
+        if self._worker is not None:
+            self._worker.join()
+            self._worker = None
+
+    def run(self):
+        """
+        Tick on the calling thread until interrupted (KeyboardInterrupt).
+        """
+        self.start()
+        try:
+            next_tick = time.perf_counter() + self.period
+            while True:
+                delay = next_tick - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                self._tick()
+
+                now = time.perf_counter()
+                next_tick += self.period
+                if next_tick <= now:
+                    # the ticker itself was held up: stay on the grid
+                    missed = int((now - next_tick) // self.period) + 1
+                    self.late_ticks += missed
+                    next_tick += missed * self.period
+        finally:
+            self.stop()
+
+    def _tick(self):
+        self.ticks += 1
+        capture = self._last_capture
+
+        with self._cond:
+            if not self._busy and not self._jobs:
+                self._jobs.append(capture)
+            else:
+                self.overruns += 1
+                instrumentation.count("overruns")
+
+                if self.policy == "skip":
+                    self.skipped += 1
+                elif self.policy == "coalesce":
+                    if self._jobs:
+                        self._jobs[-1] = capture
+                        self.coalesced += 1
+                    else:
+                        self._jobs.append(capture)
+                else:
+                    if len(self._jobs) >= self.max_queue:
+                        self._jobs.popleft()
+                        self.dropped += 1
+                    self._jobs.append(capture)
+
+            self._cond.notify()
+
+    def _work(self):
+        while True:
+            with self._cond:
+                while self._running and not self._jobs:
+                    self._cond.wait()
+                if not self._running:
+                    return
+                capture = self._jobs.popleft()
+                self._busy = True
+
+            start = time.perf_counter()
+            try:
+                shown = self.process()
+            except Exception:
+                shown = None
+                self.errors += 1
+                traceback.print_exc()
+            end = time.perf_counter()
+
+            self.completed += 1
+            self.durations.append(end - start)
+
+            if shown is not None and capture is not None:
+                self.latencies.append(end - capture + self.input_latency)
+                if instrumentation.recorder.enabled:
+                    instrumentation.recorder.record(
+                        "capture_to_display", int(capture * 1e9), int(end * 1e9)
+                    )
+
+            with self._cond:
+                self._busy = False
+
+    def format_stats(self):
+        lines = [
+            f"policy {self.policy}, period {self.period * 1000:.0f} ms: "
+            f"{self.ticks} ticks, {self.completed} hops, {self.overruns} overruns "
+            f"({self.skipped} skipped, {self.coalesced} coalesced, {self.dropped} dropped), "
+            f"{self.late_ticks} late ticks, {self.xruns} xruns, {self.errors} errors"
+        ]
+        for name, values in (("hop time", self.durations), ("capture->display", self.latencies)):
+            if values:
+                ms = sorted(v * 1000 for v in values)
+                lines.append(
+                    f"{name}: p50 {ms[len(ms) // 2]:.1f} ms, "
+                    f"p95 {ms[min(len(ms) - 1, int(len(ms) * 0.95))]:.1f} ms, max {ms[-1]:.1f} ms"
+                )
+        return "\n".join(lines)
+
+
+def add_arguments(parser):
+    parser.add_argument("--policy", choices=POLICIES, default="coalesce",
+                        help="What to do with a tick while the previous hop is still running")
@@ -1,3 +1,5 @@
+from functools import lru_cache
+
 import numpy as np
 
 NOTE_TO_PITCH_CLASS = {
@@ -10,43 +12,53 @@ CHORD_INTERVALS = {
     # Трезвучия
     "maj":  [0, 4, 7],   # мажорное
     "min":  [0, 3, 7],   # минорное
-    # # "dim":  [0, 3, 6],   # уменьшённое
-    # # "aug":  [0, 4, 8],   # увеличенное
-    #
-    # # Септаккорды
-    #
-    # # 1. Большой мажорный септаккорд (бБ7) — major seventh
-    # "maj7": [0, 4, 7, 11],
-    # #
-    # # # 2. Большой минорный септаккорд (бМ7)
-    # # # часто называется min(maj7)
-    # # "minmaj7": [0, 3, 7, 11],
-    # #
-    # # # 3. Большой увеличенный септаккорд (бУв7)
-    # # "augmaj7": [0, 4, 8, 11],
-    # #
-    # # # 4. Малый мажорный септаккорд (мБ7) — доминантсептаккорд
-    # "7": [0, 4, 7, 10],
-    #
-    # # 5. Малый минорный септаккорд (мМ7)
-    # "min7": [0, 3, 7, 10],
-    #
-    # # 6. Малый уменьшённый септаккорд (мУм7) — half-diminished
-    # "m7b5": [0, 3, 6, 10],
-    #
-    # # 7. Уменьшённый септаккорд (Ум7)
-    # "dim7": [0, 3, 6, 9],
+    "dim":  [0, 3, 6],   # уменьшённое
+    "aug":  [0, 4, 8],   # увеличенное
+
+    # Септаккорды
+
+    # 1. Большой мажорный септаккорд (бБ7) — major seventh
+    "maj7": [0, 4, 7, 11],
+
+    # 2. Большой минорный септаккорд (бМ7)
+    # часто называется min(maj7)
+    "minmaj7": [0, 3, 7, 11],
+
+    # 3. Большой увеличенный септаккорд (бУв7)
+    "augmaj7": [0, 4, 8, 11],
+
+    # 4. Малый мажорный септаккорд (мБ7) — доминантсептаккорд
+    "7": [0, 4, 7, 10],
+
+    # 5. Малый минорный септаккорд (мМ7)
+    "min7": [0, 3, 7, 10],
+
+    # 6. Малый уменьшённый септаккорд (мУм7) — half-diminished
+    "m7b5": [0, 3, 6, 10],
+
+    # 7. Уменьшённый септаккорд (Ум7)
+    "dim7": [0, 3, 6, 9],
+}
+
+# Named chord-type sets; "majmin" is the default 24-chord vocabulary
+VOCABULARIES = {
+    "majmin":   ("maj", "min"),
+    "triads":   ("maj", "min", "dim", "aug"),
+    "sevenths": ("maj", "min", "maj7", "7", "min7", "m7b5", "dim7"),
+    "full":     tuple(CHORD_INTERVALS),
 }
 
-def generate_all_templates(num_harmonics=4):
+def generate_all_templates(num_harmonics=4, vocabulary="majmin", decay=0.6):
     templates = {}
     for root, root_pc in NOTE_TO_PITCH_CLASS.items():
-        for chord_type, intervals in CHORD_INTERVALS.items():
+        for chord_type in vocabulary_chord_types(vocabulary):
+            intervals = CHORD_INTERVALS[chord_type]
             name = f"{root}:{chord_type}"
             templates[name] = build_chord_template(
                 root_pc,
                 intervals,
-                num_harmonics=num_harmonics
+                num_harmonics=num_harmonics,
+                decay=decay
             )
     return templates
 
@@ -59,15 +71,81 @@ def build_chord_template(
 ):
     template = np.zeros(12)
 
-    for interval in intervals:
-        note_pc = (root_pc + interval) % 12
+    offsets, amps = harmonic_series(num_harmonics, decay)
+    note_pcs = (root_pc + np.asarray(intervals)) % 12
 
-        for i in range(1, num_harmonics + 1):
-            amp = decay ** (i - 1)
-            harmonic_pc = (note_pc + round(12 * np.log2(i))) % 12
-            template[harmonic_pc] += amp
+    # same accumulation order as looping over notes, then harmonics
+    np.add.at(
+        template,
+        ((note_pcs[:, None] + offsets) % 12).ravel(),
+        np.tile(amps, len(note_pcs))
+    )
 
     if template.sum() > 0:
         template /= template.sum()
 
-    return template
\ No newline at end of file
+    return template
+
+
+@lru_cache(maxsize=None)
+def harmonic_series(num_harmonics, decay):
+    """
+    Pitch-class offsets and amplitudes of harmonics 1..num_harmonics.
+    """
+    harmonics = range(1, num_harmonics + 1)
+    offsets = np.array([round(12 * np.log2(i)) for i in harmonics], dtype=int)
+    amps = np.array([decay ** (i - 1) for i in harmonics])
+    offsets.flags.writeable = False
+    amps.flags.writeable = False
+    return offsets, amps
+
+
+def vocabulary_chord_types(vocabulary):
+    if isinstance(vocabulary, str):
+        return VOCABULARIES[vocabulary]
+    return tuple(vocabulary)
+
+
+class TemplateBank:
+    """
+    Precomputed chord templates for one (vocabulary, num_harmonics, decay).
+    matrix: shape (K, 12), C-contiguous
+    log_matrix: np.log(matrix + 1e-12), used by the KL2 measure
+    sq_norms: squared L2 norm of every template, used by the EUC measure
+    labels / index: chord name <-> row lookups
+    Obtain banks through get_template_bank() so they are built once.
+    """
+
+    def __init__(self, vocabulary="majmin", num_harmonics=1, decay=0.6):
+        self.vocabulary = vocabulary_chord_types(vocabulary)
+        self.num_harmonics = num_harmonics
+        self.decay = decay
+
+        templates = generate_all_templates(num_harmonics, self.vocabulary, decay)
+
+        self.labels = list(templates.keys())
+        self.index = {label: k for k, label in enumerate(self.labels)}
+
+        self.matrix = np.ascontiguousarray(np.stack(list(templates.values())))
+        self.log_matrix = np.log(self.matrix + 1e-12)
+        self.norms = np.linalg.norm(self.matrix, axis=1)
+        self.sq_norms = self.norms ** 2
+
+        for a in (self.matrix, self.log_matrix, self.norms, self.sq_norms):
+            a.flags.writeable = False
+
+    def __len__(self):
+        return len(self.labels)
+
+    @property
+    def templates(self):
+        return dict(zip(self.labels, self.matrix))
+
+
+def get_template_bank(vocabulary="majmin", num_harmonics=1, decay=0.6):
+    return _template_bank(vocabulary_chord_types(vocabulary), num_harmonics, decay)
+
+
+@lru_cache(maxsize=32)
+def _template_bank(chord_types, num_harmonics, decay):
+    return TemplateBank(chord_types, num_harmonics, decay)
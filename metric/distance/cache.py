@@ -0,0 +1,113 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+class ChromaCache:
+    """
+    Content-addressed on-disk chromagram cache.
+
+    Entries are keyed by a hash of the audio file contents plus the
+    feature parameters, stored as <key>.npy and returned memory-mapped
+    (read-only). The directory is kept under max_bytes by evicting the
+    least recently used entries; access time is tracked through the file
+    mtime, which is refreshed on every hit.
+    """
+
+    def __init__(self, directory, max_bytes=2 * 1024 ** 3):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._file_hashes = {}
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        entries = self._entries()
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+    def key(self, audio_path, **params):
+        digest = hashlib.sha1(self._file_hash(audio_path).encode())
+        digest.update(json.dumps(params, sort_keys=True).encode())
+        return digest.hexdigest()
+
+    def get_or_compute(self, audio_path, compute, **params):
+        """
+        Return the cached chromagram for (audio contents, params), or
+        call compute() and store its result.
+        """
+        path = os.path.join(self.directory, self.key(audio_path, **params) + ".npy")
+
+        if os.path.exists(path):
+            try:
+                C = np.load(path, mmap_mode="r")
+                os.utime(path)
+                self.hits += 1
+                return C
+            except (OSError, ValueError):
+                # truncated or concurrently evicted entry: recompute
+                pass
+
+        self.misses += 1
+        C = compute()
+
+        # write under a temporary name so readers never see partial files
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, C)
+        os.replace(tmp, path)
+
+        self._evict()
+        return C
+
+    def clear(self):
+        for path, _, _ in self._entries():
+            os.remove(path)
+
+    def _file_hash(self, audio_path):
+        stat = os.stat(audio_path)
+        # hashing is only redone when the file changes on disk
+        ident = (os.path.abspath(audio_path), stat.st_size, stat.st_mtime_ns)
+        if ident not in self._file_hashes:
+            h = hashlib.sha1()
+            with open(audio_path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            self._file_hashes[ident] = h.hexdigest()
+        return self._file_hashes[ident]
+
+    def _entries(self):
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".npy"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((entry.path, stat.st_size, stat.st_mtime))
+        return entries
+
+    def _evict(self):
+        entries = sorted(self._entries(), key=lambda e: e[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                # already gone, or still mapped by a reader (Windows)
+                continue
+            total -= size
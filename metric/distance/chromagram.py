@@ -1,47 +1,281 @@
+import inspect
+
 import numpy as np
-import librosa
+from common.chroma import (
+    TuningTracker,
+    cq_to_chroma_matrix,
+    cqt_kernel,
+    file_tuning,
+    max_normalize,
+    power_to_chroma,
+    tuning_from_peaks,
+    tuning_peaks
+)
+from common.instrumentation import stage
+
+# librosa is imported inside the functions that use it, so importing the
+# distance package (e.g. for the realtime scorer) stays cheap
+
+
+def load_audio(audio_path, sr=44100):
+    import librosa
+
+    with stage("load"):
+        y, sr = librosa.load(audio_path, sr=sr, mono=True)
+    return y, sr
+
+
+class AnalysisPlan:
+    """
+    STFT analysis settings of chromagram_stft.
+    frame_length_ms / hop_length_ms: window and hop
+    analysis_sr: resample to this rate before the STFT (None keeps the
+        input rate; never upsamples). Chroma weights content around
+        880 Hz most, so a lower rate mostly drops bins it barely uses.
+    fast_fft: zero-pad each window to scipy.fft.next_fast_len instead
+        of transforming e.g. 33207 samples (a slow, odd length)
+    Window and hop are rounded to whole samples at the analysis rate;
+    use hop_seconds() to map frame indices to time.
+    """
+
+    def __init__(self, frame_length_ms=753, hop_length_ms=93, analysis_sr=None, fast_fft=False):
+        self.frame_length_ms = frame_length_ms
+        self.hop_length_ms = hop_length_ms
+        self.analysis_sr = analysis_sr
+        self.fast_fft = fast_fft
+
+    def rate(self, sr):
+        return min(self.analysis_sr, sr) if self.analysis_sr else sr
+
+    def sizes(self, sr):
+        """
+        (analysis rate, window length, FFT length, hop length) for input
+        at sr.
+        """
+        rate = self.rate(sr)
+        win_length = int(rate * self.frame_length_ms / 1000)
+        hop_length = int(rate * self.hop_length_ms / 1000)
+
+        n_fft = win_length
+        if self.fast_fft:
+            from scipy.fft import next_fast_len
+            n_fft = next_fast_len(win_length, real=True)
+
+        return rate, win_length, n_fft, hop_length
+
+    def hop_seconds(self, sr):
+        rate, _, _, hop_length = self.sizes(sr)
+        return hop_length / rate
+
+    def resample(self, y, sr):
+        rate = self.rate(sr)
+        if rate == sr:
+            return y, sr
+
+        import librosa
+
+        with stage("resample"):
+            return librosa.resample(y, orig_sr=sr, target_sr=rate), rate
+
+    def params(self):
+        params = {
+            "frame_length_ms": self.frame_length_ms,
+            "hop_length_ms": self.hop_length_ms,
+        }
+        # only non-default settings, so existing cache keys stay valid
+        if self.analysis_sr:
+            params["analysis_sr"] = self.analysis_sr
+        if self.fast_fft:
+            params["fast_fft"] = True
+        return params
+
+    def __repr__(self):
+        args = ", ".join(f"{k}={v!r}" for k, v in self.params().items())
+        return f"AnalysisPlan({args})"
 
 
 def compute_chromagram(
     audio_path,
-    alg="CQT1"
+    alg="CQT1",
+    cache=None,
+    plan=None,
+    force_tuning=False
 ):
+    """
+    Tuning is estimated once per file and analysis (file_tuning);
+    force_tuning=True estimates it again.
+    """
+    sr = 44100
+
+    if cache is not None:
+        return cache.get_or_compute(
+            audio_path,
+            lambda: compute_chromagram(audio_path, alg, plan=plan, force_tuning=force_tuning),
+            **chromagram_params(alg, plan, sr)
+        )
+
+    # load straight at the analysis rate: one resampling instead of two
+    if plan is not None and alg != "CQT":
+        sr = plan.rate(sr)
+
+    return compute_chromagram_from_signal(
+        *load_audio(audio_path, sr=sr),
+        alg=alg,
+        plan=plan,
+        tuning=file_tuning(audio_path, tuning_analysis(alg, plan), force_tuning)
+    )
+
+def chromagram_params(alg="CQT1", plan=None, sr=44100):
+    """
+    Every setting compute_chromagram(alg=alg, plan=plan) depends on when
+    loading at sr; used as the chroma cache key.
+    """
+    import librosa
+
+    if alg == "CQT":
+        # compute_chromagram_from_signal runs chromagram_cqt with its defaults
+        settings = {
+            name: p.default
+            for name, p in inspect.signature(chromagram_cqt).parameters.items()
+            if name not in ("y", "sr", "tuning")
+        }
+        params = {
+            "alg": "CQT",
+            "sr": sr,
+            **settings,
+        }
+    else:
+        params = {
+            "alg": "STFT",
+            "sr": sr,
+            **(plan or AnalysisPlan()).params(),
+        }
+    params["tuning"] = ["estimated", *tuning_analysis(alg, plan, sr)]
+    params["librosa"] = librosa.__version__
+    return params
+
+def tuning_analysis(alg="CQT1", plan=None, sr=44100):
+    """
+    The spectrogram compute_chromagram(alg=alg, plan=plan) estimates
+    tuning from when loading at sr; its file_tuning() key.
+    """
     if alg == "CQT":
-        return compute_chromagram_cqt(
-            audio_path =        audio_path,
+        # TuningTracker.update_from_signal
+        return ("CQT", sr, 2048)
+    return ("STFT", *(plan or AnalysisPlan()).sizes(sr))
 
+def compute_chromagram_from_signal(
+    y,
+    sr,
+    alg="CQT1",
+    plan=None,
+    tuning=None
+):
+    """
+    tuning: a value or TuningTracker; None estimates it from y for STFT
+    chroma and uses 0 for CQT chroma, as librosa does.
+    """
+    if alg == "CQT":
+        return chromagram_cqt(
+            y=y,
+            sr=sr,
+            tuning=0.0 if tuning is None else tuning
         )
     else:
-        return compute_chromagram_stft(
-            audio_path=audio_path,
+        return chromagram_stft(
+            y=y,
+            sr=sr,
+            tuning=tuning,
+            plan=plan
         )
 
 def compute_chromagram_stft(
     audio_path,
     sr=44100,
     frame_length_ms=753,
-    hop_length_ms=93
+    hop_length_ms=93,
+    tuning=None,
+    plan=None,
+    force_tuning=False
 ):
-    y, sr = librosa.load(audio_path, sr=sr, mono=True)
+    if plan is None:
+        plan = AnalysisPlan(frame_length_ms, hop_length_ms)
+    if tuning is None:
+        tuning = file_tuning(audio_path, tuning_analysis("STFT", plan, sr), force_tuning)
+
+    y, sr = load_audio(audio_path, sr=plan.rate(sr))
+
+    return chromagram_stft(y, sr, tuning=tuning, plan=plan)
 
-    n_fft = int(sr * frame_length_ms / 1000)
-    hop_length = int(sr * hop_length_ms / 1000)
 
-    S = np.abs(
+def chromagram_stft(
+    y,
+    sr=44100,
+    frame_length_ms=753,
+    hop_length_ms=93,
+    tuning=None,
+    plan=None
+):
+    """
+    tuning: deviation from A440 in fractions of a bin, a TuningTracker,
+    or None to estimate it from the whole spectrogram.
+    plan: an AnalysisPlan; overrides frame_length_ms / hop_length_ms.
+    """
+    if plan is None:
+        plan = AnalysisPlan(frame_length_ms, hop_length_ms)
+
+    y, sr = plan.resample(y, sr)
+    _, win_length, n_fft, hop_length = plan.sizes(sr)
+
+    with stage("stft", frames=stft_frame_count(len(y), n_fft, hop_length)):
+        S = stft_power(y, n_fft, hop_length, win_length=win_length)
+
+    with stage("chroma", frames=S.shape[1]):
+        C = chroma_from_power(S, sr, tuning)
+
+    return C  # shape (12, N)
+
+
+def stft_frame_count(n_samples, n_fft, hop_length):
+    # number of frames of a centered librosa.stft
+    return 1 + (n_samples + 2 * (n_fft // 2) - n_fft) // hop_length
+
+
+def stft_power(y, n_fft, hop_length, start=0, stop=None, win_length=None):
+    """
+    |librosa.stft(y, center=True)|^2, restricted to the frames
+    [start, stop). Only the samples those frames cover are transformed,
+    and the edge padding is the same as for the whole signal, so the
+    frames are identical to the corresponding columns of the full STFT.
+    """
+    import librosa
+
+    if stop is None:
+        stop = stft_frame_count(len(y), n_fft, hop_length)
+
+    # sample range of frames [start, stop) in the unpadded signal
+    a = start * hop_length - n_fft // 2
+    b = (stop - 1) * hop_length - n_fft // 2 + n_fft
+    segment = np.pad(y[max(a, 0):min(b, len(y))], (max(-a, 0), max(b - len(y), 0)))
+
+    return np.abs(
         librosa.stft(
-            y,
+            segment,
             n_fft=n_fft,
             hop_length=hop_length,
-            window="hann"
+            win_length=win_length,
+            window="hann",
+            center=False
         )
     ) ** 2
 
-    C = librosa.feature.chroma_stft(S=S, sr=sr)
+
+def chroma_from_power(S, sr, tuning=None):
+    C = power_to_chroma(S, sr, tuning)
 
     # Normalize each frame (important!)
     C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
-
-    return C  # shape (12, N)
+    return C
 
 
 def compute_chromagram_cqt(
@@ -49,33 +283,67 @@ def compute_chromagram_cqt(
     sr=44100,
     hop_length_ms=93,
     bins_per_octave=12,
-    n_octaves=7
+    n_octaves=7,
+    backend="kernel",
+    tuning=None,
+    force_tuning=False
 ):
+    if tuning is None:
+        tuning = file_tuning(audio_path, tuning_analysis("CQT", sr=sr), force_tuning)
+
     # 1. Load audio
-    y, sr = librosa.load(audio_path, sr=sr, mono=True)
+    y, sr = load_audio(audio_path, sr=sr)
+
+    return chromagram_cqt(y, sr, hop_length_ms, bins_per_octave, n_octaves, backend, tuning)
 
+
+def chromagram_cqt(
+    y,
+    sr=44100,
+    hop_length_ms=93,
+    bins_per_octave=12,
+    n_octaves=7,
+    backend="kernel",
+    tuning=0.0
+):
+    """
+    backend: "kernel" uses the cached single-FFT basis of
+    common.chroma.cqt_kernel, "librosa" calls librosa.cqt (which builds
+    its basis on every call).
+    tuning: a value or a TuningTracker
+    """
     hop_length = int(sr * hop_length_ms / 1000)
+    n_bins = bins_per_octave * n_octaves
+
+    if isinstance(tuning, TuningTracker):
+        tuning = tuning.update_from_signal(y, sr)
 
     # 2. Constant-Q Transform
-    CQT = np.abs(
-        librosa.cqt(
-            y,
-            sr=sr,
-            hop_length=hop_length,
-            bins_per_octave=bins_per_octave,
-            n_bins=bins_per_octave * n_octaves
-        )
-    ) ** 2  # power spectrum
-
-    # 3. Pitch folding → chroma
-    C = librosa.feature.chroma_cqt(
-        C=CQT,
-        sr=sr,
-        hop_length=hop_length,
-        bins_per_octave=bins_per_octave
-    )
+    # centered frames, as librosa.cqt
+    with stage("cqt", frames=1 + len(y) // hop_length):
+        if backend == "librosa":
+            import librosa
 
-    # 4. Normalize each frame
-    C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
+            CQT = np.abs(
+                librosa.cqt(
+                    y,
+                    sr=sr,
+                    hop_length=hop_length,
+                    bins_per_octave=bins_per_octave,
+                    n_bins=n_bins,
+                    tuning=tuning
+                )
+            )
+        else:
+            CQT = cqt_kernel(sr, n_bins, bins_per_octave, float(tuning)).transform(y, hop_length)
+
+        CQT **= 2  # power spectrum
+
+    # 3. Pitch folding → chroma (what chroma_cqt does with a given CQT)
+    with stage("chroma", frames=CQT.shape[1]):
+        C = max_normalize(cq_to_chroma_matrix(n_bins, bins_per_octave) @ CQT)
+
+        # 4. Normalize each frame
+        C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
 
     return C  # shape (12, N)
@@ -5,4 +5,44 @@ def euclidean_distance(x, y):
 
 def kl_divergence(x, y):
     eps = 1e-12
-    return np.sum(x * np.log((x + eps) / (y + eps)) - x + y)
\ No newline at end of file
+    return np.sum(x * np.log((x + eps) / (y + eps)) - x + y)
+
+
+def euclidean_distance_matrix(C, P, H, pp=None):
+    """
+    euclidean_distance(h * c, p) for every (template, frame) pair.
+    C: shape (12, N), P: shape (K, 12), H: shape (K, N) — scales.
+    pp: optional precomputed squared template norms.
+    Uses ||hc - p||^2 = h^2 ||c||^2 - 2h <c, p> + ||p||^2.
+    """
+    cc = np.einsum("in,in->n", C, C)
+    if pp is None:
+        pp = np.einsum("ki,ki->k", P, P)
+    D = (H * H) * cc - 2.0 * H * (P @ C) + pp[:, None]
+    return np.maximum(D, 0.0, out=D)
+
+
+def kl_divergence_matrix(C, P, H, log_P=None, block_size=2048):
+    """
+    kl_divergence(p, h * c) for every (template, frame) pair.
+    C: shape (12, N), P: shape (K, 12), H: shape (K, N) — scales.
+    log_P: optional precomputed np.log(P + eps).
+    Frames are processed in blocks of block_size to bound the
+    (K, 12, block_size) temporary.
+    """
+    eps = 1e-12
+    if log_P is None:
+        log_P = np.log(P + eps)
+
+    # sum_i p_i log(p_i + eps) - p_i does not depend on the frame
+    const = np.sum(P * log_P - P, axis=1)
+    c_sum = C.sum(axis=0)
+
+    K, N = H.shape
+    D = np.empty((K, N))
+    for start in range(0, N, block_size):
+        stop = min(start + block_size, N)
+        hc = H[:, None, start:stop] * C[None, :, start:stop]
+        cross = np.einsum("ki,kin->kn", P, np.log(hc + eps))
+        D[:, start:stop] = const[:, None] - cross + H[:, start:stop] * c_sum[start:stop]
+    return D
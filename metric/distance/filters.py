@@ -1,35 +1,239 @@
-from scipy.signal import medfilt
 import numpy as np
 
-def low_pass_filter(D, L):
-    kernel = np.ones(L) / L
-    return np.apply_along_axis(
-        lambda x: np.convolve(x, kernel, mode="same"),
-        axis=1,
-        arr=D
-    )
+# Edge handling of the offline filters is passed straight to scipy.ndimage:
+# "constant" (zero padding, same as np.convolve(mode="same") and medfilt),
+# "nearest", "reflect", "mirror" or "wrap".
+# scipy.ndimage is imported where it is used: it takes a few hundred ms
+# and the realtime path (the Causal* classes) does not need it.
 
+def low_pass_filter(D, L, mode="constant", out=None):
+    """
+    Centered moving average of every template row in one call.
+    D: shape (K, N) — distance matrix, float32 or float64
+    L: window length
+    """
+    from scipy import ndimage
 
-def median_filter_offline(D, L):
-    return np.apply_along_axis(
-        lambda x: medfilt(x, kernel_size=L),
-        axis=1,
-        arr=D
+    D = _as_float(D)
+    return ndimage.correlate1d(
+        D, _box_kernel(L), axis=-1, mode=mode, output=out
     )
 
-def median_filter(D, L):
+
+def median_filter_offline(D, L, mode="constant", out=None):
+    """
+    Centered median filter of every template row in one call.
+    With mode="constant" this matches scipy.signal.medfilt (odd L).
+    """
+    D = _as_float(D)
+    if out is None:
+        out = np.empty_like(D)
+    return _rank_median(D, L, 0, mode, out)
+
+def median_filter(D, L, mode=None, out=None):
     """
     Causal (realtime) median filter.
     D: shape (K, N) — distance matrix
     L: window length
+    mode=None shrinks the window at the start of the signal (the first
+    frames use only the values seen so far); any ndimage mode pads instead.
+    """
+    D = _as_float(D)
+    if out is None:
+        out = np.empty_like(D)
+
+    _rank_median(D, L, (L - 1) // 2, "constant" if mode is None else mode, out)
+
+    if mode is None:
+        # the first frames see only the values so far: pad the prefix
+        # windows with +inf, sort them all at once and pick the middle
+        m = min(L - 1, D.shape[-1])
+        if m > 0:
+            n = np.arange(m)
+            windows = np.sort(np.where(n <= n[:, None], D[..., None, :m], np.inf), axis=-1)
+            out[..., :m] = (windows[..., n, n // 2] + windows[..., n, (n + 1) // 2]) / 2
+
+    return out
+
+
+def low_pass_median_filter(D, L_lp=5, L_med=17, causal=True, mode="constant", out=None):
+    """
+    Fused "LP+M" chain: low_pass_filter(D, L_lp) followed by median_filter
+    (causal=True) or median_filter_offline (causal=False) with L_med.
+    The low-pass output is staged one row at a time in a single reused
+    buffer, so no intermediate (K, N) array is allocated.
+    """
+    from scipy import ndimage
+
+    D = _as_float(D)
+    if out is None:
+        out = np.empty_like(D)
+
+    kernel = _box_kernel(L_lp)
+    row = np.empty(D.shape[-1], dtype=D.dtype)
+
+    for k in range(D.shape[0]):
+        ndimage.correlate1d(D[k], kernel, mode=mode, output=row)
+        if causal:
+            median_filter(row, L_med, out=out[k])
+        else:
+            median_filter_offline(row, L_med, mode=mode, out=out[k])
+
+    return out
+
+
+def _as_float(D):
+    D = np.asarray(D)
+    if D.dtype not in (np.float32, np.float64):
+        D = D.astype(np.float64)
+    return D
+
+
+def _box_kernel(L):
+    return np.full(L, 1.0 / L)
+
+
+def _rank_median(D, L, origin, mode, out):
+    # ndimage dispatches 1-D inputs to a much faster rank filter than a
+    # (1, L) footprint on the full matrix, so filter row by row
+    if D.ndim > 1:
+        for k in range(D.shape[0]):
+            _rank_median(D[k], L, origin, mode, out[k])
+        return out
+
+    from scipy import ndimage
+
+    if L % 2:
+        return ndimage.median_filter(D, size=L, origin=origin, mode=mode, output=out)
+
+    # ndimage's median picks rank L // 2; for even L average the two
+    # middle ranks so the result agrees with np.median
+    ndimage.rank_filter(D, L // 2 - 1, size=L, origin=origin, mode=mode, output=out)
+    out += ndimage.rank_filter(D, L // 2, size=L, origin=origin, mode=mode)
+    out *= 0.5
+    return out
+
+
+class CausalMedianFilter:
+    """
+    Stateful causal median filter for streaming distance columns.
+    Keeps the last L values of every template row as a sorted window;
+    each new column removes the oldest value and inserts the new one by
+    rebuilding the windows with vectorized numpy ops, O(K * L) per
+    column. That is cheap for the short windows used here (L = 17); a
+    tree or skip list would be O(log L) per row but needs a Python loop
+    over the rows. Output matches median_filter on the concatenation of
+    all columns pushed so far.
+
+    NaN cannot be ordered in the sorted windows, so input containing NaN
+    raises ValueError.
+    """
+
+    def __init__(self, L):
+        self.L = L
+        self.reset()
+
+    def reset(self):
+        self._sorted = None   # (K, w) sorted window per row
+        self._ring = None     # (K, L) values in arrival order
+        self._pos = 0
+        self._count = 0
+
+    def process(self, D):
+        """
+        D: shape (K,) — one new column, or (K, M) — a block of columns.
+        Returns the filtered column(s) with the same shape.
+        """
+        D = np.asarray(D)
+        if D.ndim == 1:
+            return self.process(D[:, None])[:, 0]
+
+        if np.isnan(D).any():
+            raise ValueError("CausalMedianFilter input contains NaN")
+
+        K, M = D.shape
+        if self._ring is None:
+            self._ring = np.zeros((K, self.L), dtype=D.dtype)
+            self._sorted = np.zeros((K, 0), dtype=D.dtype)
+
+        out = np.empty((K, M), dtype=D.dtype)
+        for m in range(M):
+            out[:, m] = self._push(D[:, m])
+        return out
+
+    def _push(self, x):
+        S = self._sorted
+        K, w = S.shape
+        rows = np.arange(K)
+
+        if self._count >= self.L:
+            old = self._ring[:, self._pos]
+            drop = np.argmax(S == old[:, None], axis=1)
+            keep = np.ones(S.shape, dtype=bool)
+            keep[rows, drop] = False
+            S = S[keep].reshape(K, w - 1)
+            w -= 1
+
+        # insert x into each sorted row
+        ins = np.sum(S < x[:, None], axis=1)
+        cols = np.arange(w + 1)
+        src = np.clip(cols - (cols > ins[:, None]), 0, max(w - 1, 0))
+        S_new = np.take_along_axis(S, src, axis=1) if w else np.empty((K, 1), dtype=S.dtype)
+        S_new[cols[None, :] == ins[:, None]] = x
+        self._sorted = S_new
+
+        self._ring[:, self._pos] = x
+        self._pos = (self._pos + 1) % self.L
+        self._count += 1
+
+        w += 1
+        if w % 2:
+            return S_new[:, w // 2]
+        return 0.5 * (S_new[:, w // 2 - 1] + S_new[:, w // 2])
+
+
+class CausalLowPassFilter:
+    """
+    Stateful causal moving average of length L for streaming distance
+    columns, equivalent to np.convolve(x, np.ones(L) / L)[:N] per row
+    (zero history before the first column). Keeps a running sum, so each
+    new column costs O(K) regardless of L.
     """
-    K, N = D.shape
-    D_out = np.zeros_like(D)
 
-    for k in range(K):
-        for n in range(N):
-            start = max(0, n - L + 1)
-            window = D[k, start:n + 1]
-            D_out[k, n] = np.median(window)
+    def __init__(self, L):
+        self.L = L
+        self.reset()
+
+    def reset(self):
+        self._ring = None
+        self._sum = None
+        self._pos = 0
+
+    def process(self, D):
+        """
+        D: shape (K,) — one new column, or (K, M) — a block of columns.
+        Returns the filtered column(s) with the same shape.
+        """
+        D = np.asarray(D)
+        if D.ndim == 1:
+            return self.process(D[:, None])[:, 0]
+
+        if np.isnan(D).any():
+            raise ValueError("CausalMedianFilter input contains NaN")
+
+        K, M = D.shape
+        if self._ring is None:
+            self._ring = np.zeros((K, self.L), dtype=D.dtype)
+            self._sum = np.zeros(K, dtype=D.dtype)
 
-    return D_out
\ No newline at end of file
+        out = np.empty((K, M), dtype=D.dtype)
+        for m in range(M):
+            x = D[:, m]
+            self._sum += x - self._ring[:, self._pos]
+            self._ring[:, self._pos] = x
+            self._pos = (self._pos + 1) % self.L
+            if self._pos == 0:
+                # resync to keep rounding drift bounded on long streams
+                self._sum = self._ring.sum(axis=1)
+            out[:, m] = self._sum / self.L
+        return out
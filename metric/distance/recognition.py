@@ -3,30 +3,58 @@ from .distances import *
 from .chromagram import *
 from .filters import *
 from .base_generation import *
+from .cache import *
+from common.chroma import STREAM_TUNING_RATE, IncrementalChroma, TuningTracker
+from common.instrumentation import stage
 
 def recognize_chords_framewise(C, templates, measure="KL2"):
+    """
+    templates: a TemplateBank, or a {chord name: template} dict.
+    """
+    if isinstance(templates, TemplateBank):
+        return templates.labels, compute_distance_matrix(
+            C,
+            templates.matrix,
+            measure,
+            log_P=templates.log_matrix,
+            sq_norms=templates.sq_norms
+        )
+
     chord_names = list(templates.keys())
     P = np.stack([templates[k] for k in chord_names])
 
-    N = C.shape[1]
-    K = len(chord_names)
+    return chord_names, compute_distance_matrix(C, P, measure)
 
-    D = np.zeros((K, N))
+def compute_distance_matrix(C, P, measure="KL2", log_P=None, sq_norms=None):
+    """
+    Batched scoring of all frames against all templates.
+    C: shape (12, N) — chromagram
+    P: shape (K, 12) — template matrix
+    log_P, sq_norms: optional precomputed template logs / squared norms
+    Returns D of shape (K, N).
+    """
+    H = optimal_scale_matrix(C, P)
 
-    for n in range(N):
-        c = C[:, n]
+    if measure == "EUC":
+        return euclidean_distance_matrix(C, P, H, sq_norms)
+    elif measure == "KL2":
+        return kl_divergence_matrix(C, P, H, log_P)
 
-        for k in range(K):
-            p = P[k]
-            h = optimal_scale(c, p)
-            hc = h * c
+    return np.zeros((P.shape[0], C.shape[1]))
 
-            if measure == "EUC":
-                D[k, n] = euclidean_distance(hc, p)
-            elif measure == "KL2":
-                D[k, n] = kl_divergence(p, hc)
+def compute_distance_matrices(Cs, P, measure="KL2", log_P=None, sq_norms=None):
+    """
+    compute_distance_matrix for several streams at once.
+    Cs: list of (12, M_s) chromagrams, e.g. the new frames of S streams
+    Frames are scored independently, so all streams are stacked and
+    scored against P in one call; returns a list of (K, M_s) views.
+    """
+    if not Cs:
+        return []
 
-    return chord_names, D
+    sizes = [C.shape[1] for C in Cs]
+    D = compute_distance_matrix(np.concatenate(Cs, axis=1), P, measure, log_P, sq_norms)
+    return np.split(D, np.cumsum(sizes)[:-1], axis=1)
 
 def decode_chords(D):
     return np.argmin(D, axis=0)
@@ -36,19 +64,271 @@ def chord_recognition(
     num_harmonics=1,
     measure="KL2",
     filtering="LP+M",
-    L=17
+    L=17,
+    vocabulary="majmin",
+    cache=None,
+    plan=None,
+    force_tuning=False
+):
+    C = compute_chromagram(audio_path, cache=cache, plan=plan, force_tuning=force_tuning)
+
+    return chord_recognition_from_chromagram(
+        C,
+        num_harmonics=num_harmonics,
+        measure=measure,
+        filtering=filtering,
+        L=L,
+        vocabulary=vocabulary
+    )
+
+def chord_recognition_from_signal(
+    y,
+    sr,
+    num_harmonics=1,
+    measure="KL2",
+    filtering="LP+M",
+    L=17,
+    vocabulary="majmin",
+    plan=None
 ):
-    C = compute_chromagram(audio_path)
-    templates = generate_all_templates(num_harmonics)
+    C = compute_chromagram_from_signal(y, sr, plan=plan)
+
+    return chord_recognition_from_chromagram(
+        C,
+        num_harmonics=num_harmonics,
+        measure=measure,
+        filtering=filtering,
+        L=L,
+        vocabulary=vocabulary
+    )
+
+def chord_recognition_from_chromagram(
+    C,
+    num_harmonics=1,
+    measure="KL2",
+    filtering="LP+M",
+    L=17,
+    vocabulary="majmin"
+):
+    bank = get_template_bank(vocabulary, num_harmonics)
+    N = C.shape[1]
+
+    with stage("scoring", frames=N):
+        chord_names, D = recognize_chords_framewise(C, bank, measure)
 
-    chord_names, D = recognize_chords_framewise(C, templates, measure)
+    with stage("filtering", frames=N):
+        D = apply_filtering(D, filtering, L)
 
+    with stage("decoding", frames=N):
+        idx = decode_chords(D)
+    return [chord_names[i] for i in idx]
+
+def apply_filtering(D, filtering="LP+M", L=17):
     if filtering == "lowpass":
         D = low_pass_filter(D, L)
     elif filtering == "median":
         D = median_filter(D, L)
     elif filtering == "LP+M":
-        D = median_filter(low_pass_filter(D, 5), 17)
+        D = low_pass_median_filter(D, 5, 17)
+    return D
 
-    idx = decode_chords(D)
-    return [chord_names[i] for i in idx]
+def filter_context(filtering="LP+M", L=17):
+    """
+    (past, future): how many neighbouring frames on each side
+    apply_filtering() reads to produce one output frame.
+    """
+    if filtering == "lowpass":
+        return L // 2, L // 2
+    elif filtering == "median":
+        return L - 1, 0
+    elif filtering == "LP+M":
+        return 5 // 2 + 17 - 1, 5 // 2
+    return 0, 0
+
+def causal_filters(filtering="LP+M", L=17):
+    """
+    Stateful counterparts of apply_filtering() for block-wise processing;
+    apply them in order with .process(D).
+    """
+    if filtering == "lowpass":
+        return [CausalLowPassFilter(L)]
+    elif filtering == "median":
+        return [CausalMedianFilter(L)]
+    elif filtering == "LP+M":
+        return [CausalLowPassFilter(5), CausalMedianFilter(17)]
+    return []
+
+def chord_recognition_stream(
+    audio_path,
+    num_harmonics=1,
+    measure="KL2",
+    filtering="LP+M",
+    L=17,
+    vocabulary="majmin",
+    block_seconds=10.0,
+    sr=44100,
+    frame_length_ms=753,
+    hop_length_ms=93,
+    force_tuning=False,
+    plan=None
+):
+    """
+    Generator of (start, end, chord) segments for hours-long recordings.
+
+    The file is read in blocks with soundfile (and resampled to sr, or
+    the plan's analysis rate, with a soxr stream when its rate differs); an IncrementalChroma with
+    center=True carries the frame overlap between blocks. Distances and
+    causal filters run per block, so memory does not grow with the file
+    length and the first segments are yielded after the first block.
+
+    Differences to chord_recognition(): tuning is tracked block by block
+    (TuningTracker) instead of estimated over the whole file, and the
+    low-pass part of "LP+M" is causal instead of centered.
+    force_tuning=True re-estimates tuning for every block instead.
+    """
+    import soundfile as sf
+
+    if plan is None:
+        plan = AnalysisPlan(frame_length_ms, hop_length_ms)
+
+    bank = get_template_bank(vocabulary, num_harmonics)
+    sr, win_length, n_fft, hop_length = plan.sizes(sr)
+    extractor = IncrementalChroma(
+        sr, n_fft, hop_length,
+        tuning=TuningTracker(STREAM_TUNING_RATE, force=force_tuning), center=True, win_length=win_length
+    )
+    filters = causal_filters(filtering, L)
+    segments = _SegmentBuilder(bank.labels, hop_length / sr)
+
+    def recognize_block(y):
+        C = extractor.push(y) if y is not None else extractor.flush()
+        N = C.shape[1]
+        if N == 0:
+            return []
+
+        C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
+        with stage("scoring", frames=N):
+            D = compute_distance_matrix(C, bank.matrix, measure, bank.log_matrix, bank.sq_norms)
+        with stage("filtering", frames=N):
+            for f in filters:
+                D = f.process(D)
+        with stage("decoding", frames=N):
+            return segments.push(decode_chords(D))
+
+    with sf.SoundFile(audio_path) as f:
+        resampler = None
+        if f.samplerate != sr:
+            import soxr
+            resampler = soxr.ResampleStream(f.samplerate, sr, 1, dtype="float32")
+
+        blocks = f.blocks(blocksize=int(f.samplerate * block_seconds), dtype="float32", always_2d=True)
+        for block in blocks:
+            y = block.mean(axis=1)
+            if resampler is not None:
+                y = resampler.resample_chunk(y)
+            yield from recognize_block(y)
+
+        if resampler is not None:
+            yield from recognize_block(resampler.resample_chunk(np.zeros(0, dtype=np.float32), last=True))
+
+    yield from recognize_block(None)
+    yield from segments.close()
+
+def chord_recognition_parallel(
+    audio_path,
+    num_harmonics=1,
+    measure="KL2",
+    filtering="LP+M",
+    L=17,
+    vocabulary="majmin",
+    workers=None,
+    chunk_seconds=60.0,
+    sr=44100,
+    frame_length_ms=753,
+    hop_length_ms=93,
+    plan=None,
+    force_tuning=False
+):
+    """
+    chord_recognition() for long files, split into chunks of frames that
+    are analyzed in a thread pool (FFT, BLAS and ndimage release the GIL).
+
+    Each chunk also computes the filter_context() frames around it, whose
+    spectra come from the real neighbouring samples, so after dropping
+    them the labels are the same as those of the serial path. Tuning is
+    the file's file_tuning(); when it is not known yet (or force_tuning),
+    it is estimated over the whole file from the spectral peaks of all
+    chunks (first pass) before the chroma, scoring and filtering pass.
+    """
+    from concurrent.futures import ThreadPoolExecutor
+
+    if plan is None:
+        plan = AnalysisPlan(frame_length_ms, hop_length_ms)
+
+    tracker = file_tuning(audio_path, tuning_analysis("STFT", plan, sr), force_tuning)
+    y, sr = load_audio(audio_path, sr=plan.rate(sr))
+
+    bank = get_template_bank(vocabulary, num_harmonics)
+    _, win_length, n_fft, hop_length = plan.sizes(sr)
+    N = stft_frame_count(len(y), n_fft, hop_length)
+
+    past, future = filter_context(filtering, L)
+    size = max(int(chunk_seconds * sr / hop_length), 1)
+    chunks = [(a, min(a + size, N)) for a in range(0, N, size)]
+
+    def spectrum(chunk):
+        a, b = chunk
+        lo, hi = max(a - past, 0), min(b + future, N)
+        S = stft_power(y, n_fft, hop_length, lo, hi, win_length)
+        if tracker.settled:
+            return lo, S, None
+        # tuning peaks of the chunk's own frames only, so none is counted twice
+        return lo, S, tuning_peaks(S[:, a - lo:b - lo], sr)
+
+    def recognize(chunk, spectrum, tuning):
+        a, b = chunk
+        lo, S, _ = spectrum
+        C = chroma_from_power(S, sr, tuning)
+        D = compute_distance_matrix(C, bank.matrix, measure, bank.log_matrix, bank.sq_norms)
+        D = apply_filtering(D, filtering, L)
+        return decode_chords(D[:, a - lo:b - lo])
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        with stage("stft", frames=N):
+            spectra = list(pool.map(spectrum, chunks))
+            tuning = tracker.update_from_peaks([peaks for _, _, peaks in spectra])
+
+        with stage("recognition", frames=N):
+            idx = np.concatenate(list(pool.map(recognize, chunks, spectra, [tuning] * len(chunks))))
+
+    return [bank.labels[i] for i in idx]
+
+class _SegmentBuilder:
+    """
+    Turns framewise chord indices into (start, end, chord) segments,
+    returning each segment once it is closed by a chord change.
+    """
+
+    def __init__(self, labels, hop):
+        self.labels = labels
+        self.hop = hop
+        self.frames = 0
+        self.start = 0
+        self.current = None
+
+    def push(self, idx):
+        closed = []
+        for i in idx:
+            if i != self.current:
+                if self.current is not None:
+                    closed.append(self._segment())
+                self.start = self.frames
+                self.current = i
+            self.frames += 1
+        return closed
+
+    def close(self):
+        return [self._segment()] if self.current is not None else []
+
+    def _segment(self):
+        return (self.start * self.hop, self.frames * self.hop, self.labels[self.current])
@@ -4,4 +4,19 @@ def optimal_scale(c, p):
     denom = np.dot(c, c)
     if denom < 1e-12:
         return 0.0
-    return np.dot(c, p) / denom
\ No newline at end of file
+    return np.dot(c, p) / denom
+
+
+def optimal_scale_matrix(C, P):
+    """
+    Batched optimal_scale for every (template, frame) pair.
+    C: shape (12, N) — chromagram
+    P: shape (K, 12) — template matrix
+    Returns H of shape (K, N); each row is the per-frame scale vector h
+    of one template.
+    """
+    denom = np.einsum("in,in->n", C, C)
+    silent = denom < 1e-12
+    H = (P @ C) / np.where(silent, 1.0, denom)
+    H[:, silent] = 0.0
+    return H
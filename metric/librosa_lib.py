@@ -1,12 +1,15 @@
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import tempfile
-import time
+import sys
 import os
-import threading
-import librosa
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, scheduler as hop_scheduler
+from common.chroma import STREAM_TUNING_RATE, IncrementalChroma, TuningTracker, file_tuning, power_to_chroma
+from common.instrumentation import stage
+from common.ring_buffer import RingBuffer
+
+# librosa, scipy and sounddevice are imported only where a mode needs them
 
 # ==========================
 # CONFIG
@@ -19,8 +22,11 @@ HOP_SECONDS = 0.5
 BUFFER_SIZE = int(SR * BUFFER_SECONDS)
 HOP_SIZE = int(SR * HOP_SECONDS)
 
-audio_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
-buffer_lock = threading.Lock()
+WARMUP_SECONDS = 1.0
+
+CHROMA_HOP = 512
+
+audio_buffer = RingBuffer(BUFFER_SIZE)
 
 # ==========================
 # CHORD TEMPLATES
@@ -59,30 +65,32 @@ TEMPLATES = TEMPLATES / (np.linalg.norm(TEMPLATES, axis=1, keepdims=True)+1e-6)
 
 def audio_callback(indata, frames, time_info, status):
 
-    if status:
-        print(status)
-
-    samples = indata[:,0]
-
-    with buffer_lock:
-
-        n = len(samples)
+    audio_buffer.write(indata[:, 0])
 
-        audio_buffer[:-n] = audio_buffer[n:]
-        audio_buffer[-n:] = samples
+    # xruns are counted by the scheduler instead of printed from the callback
+    scheduler.on_capture(status)
 
 # ==========================
 # FEATURE EXTRACTION
 # ==========================
 
-def extract_chroma(y):
+def extract_chroma(y, tuning=None):
 
-    chroma = librosa.feature.chroma_stft(
-        y=y,
-        sr=SR,
-        n_fft=2048,
-        hop_length=512
-    )
+    # tuning: a value or TuningTracker; None estimates it from y
+
+    import librosa
+
+    S = np.abs(librosa.stft(y, n_fft=2048, hop_length=CHROMA_HOP)) ** 2
+
+    # cached filter bank: the chroma step is one matrix product
+    chroma = power_to_chroma(S, SR, tuning)
+
+    return normalize_chroma(chroma)
+
+
+def normalize_chroma(chroma):
+
+    # (12, T) chroma -> (T, 12) unit-norm frames
 
     chroma = chroma.T
 
@@ -102,21 +110,60 @@ def template_recognition(chroma):
 
     return chord_indices
 
+
+def template_recognition_batch(chromas):
+
+    # template_recognition for several streams in one product; returns
+    # the chord indices split back per stream
+
+    if not chromas:
+
+        return []
+
+    sizes = [len(chroma) for chroma in chromas]
+
+    return np.split(template_recognition(np.concatenate(chromas)), np.cumsum(sizes)[:-1])
+
 # ==========================
 # CHORD RECOGNITION
 # ==========================
 
-def recognize_chords(wav_path):
+def recognize_chords(wav_path, force_tuning=False):
+
+    import librosa
+
+    with stage("load"):
+
+        y, sr = librosa.load(wav_path, sr=SR)
+
+    # tuning is estimated once per file from extract_chroma's spectrogram
+    tuning = file_tuning(wav_path, ("librosa.stft", SR, 2048, CHROMA_HOP), force_tuning)
+
+    return recognize_chords_signal(y, sr, tuning)
+
+
+def recognize_chords_signal(y, sr, tuning=None):
+
+    if sr != SR:
 
-    y, sr = librosa.load(wav_path, sr=SR)
+        import librosa
 
-    chroma = extract_chroma(y)
+        with stage("resample"):
 
-    path = template_recognition(chroma)
+            y = librosa.resample(y, orig_sr=sr, target_sr=SR)
+
+    # extract_chroma runs the STFT and the chroma folding together
+    with stage("stft+chroma"):
+
+        chroma = extract_chroma(y, tuning)
+
+    with stage("decoding", frames=len(chroma)):
+
+        path = template_recognition(chroma)
 
     chords = []
 
-    hop = 512 / SR
+    hop = CHROMA_HOP / SR
 
     start = 0
     current = path[0]
@@ -140,37 +187,58 @@ def recognize_chords(wav_path):
 # REALTIME PROCESSING
 # ==========================
 
+# created by main() in realtime mode
+chroma_extractor = None
+
 def process_audio_buffer():
 
-    with buffer_lock:
-        buffer_copy = audio_buffer.copy()
+    # only the newly captured audio is transformed
+    with stage("hop"):
+
+        chroma = chroma_extractor.push(audio_buffer.read_new())
+
+        if chroma.shape[1] == 0:
+
+            return
 
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        wav_path = tmp.name
+        with stage("decoding", frames=chroma.shape[1]):
 
-    sf.write(wav_path, buffer_copy, SR)
+            path = template_recognition(normalize_chroma(chroma))
 
-    try:
+    last = CHORD_LABELS[path[-1]]
 
-        chords = recognize_chords(wav_path)
+    print(f"\r🎶 {last:10s}", end="", flush=True)
 
-        if len(chords) > 0:
+    return last
 
-            last = chords[-1][2]
+scheduler = hop_scheduler.HopScheduler(process_audio_buffer, HOP_SECONDS)
 
-            print(f"\r🎶 {last:10s}", end="", flush=True)
+def warmup():
 
-    finally:
+    # run the file and realtime paths once on a short dummy chord so the
+    # first hop does not pay for lazy imports and numba compilation
 
-        os.remove(wav_path)
+    start = time.perf_counter()
+
+    t = np.arange(int(SR * WARMUP_SECONDS)) / SR
+
+    y = (sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3).astype(np.float32)
+
+    recognize_chords_signal(y, SR)
+
+    chroma = IncrementalChroma(SR, 2048, CHROMA_HOP).push(y)
+
+    template_recognition(normalize_chroma(chroma))
+
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s")
 
 # ==========================
 # FILE MODE
 # ==========================
 
-def process_file(path):
+def process_file(path, force_tuning=False):
 
-    chords = recognize_chords(path)
+    chords = recognize_chords(path, force_tuning)
 
     for start, end, chord in chords:
 
@@ -182,37 +250,64 @@ def process_file(path):
 
 def main():
 
+    global chroma_extractor
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", "-f")
 
+    parser.add_argument("--warmup", action="store_true", help="Exercise the processing path on a dummy signal before capture starts")
+
+    parser.add_argument("--force-tuning", action="store_true", help="Re-estimate tuning on every call instead of once per file / slowly per stream")
+
+    hop_scheduler.add_arguments(parser)
+
+    instrumentation.add_arguments(parser)
+
     args = parser.parse_args()
 
+    instrumentation.configure(args)
+
     if args.file:
 
         print(f"📂 Processing file: {args.file}")
-        process_file(args.file)
+        process_file(args.file, args.force_tuning)
+        instrumentation.finish(args)
         return
 
     print("🎤 Template chord recognition realtime")
 
+    import sounddevice as sd
+
+    chroma_extractor = IncrementalChroma(
+        SR, 2048, CHROMA_HOP, tuning=TuningTracker(STREAM_TUNING_RATE, force=args.force_tuning)
+    )
+
+    if args.warmup:
+
+        warmup()
+
+    scheduler.policy = args.policy
+
     with sd.InputStream(
         channels=1,
         samplerate=SR,
         blocksize=HOP_SIZE,
         callback=audio_callback
-    ):
-
-        try:
+    ) as stream:
 
-            while True:
+        scheduler.input_latency = stream.latency
 
-                time.sleep(HOP_SECONDS)
+        try:
 
-                process_audio_buffer()
+            scheduler.run()
 
         except KeyboardInterrupt:
 
             print("\nStopped")
 
+    print(scheduler.format_stats())
+
+    instrumentation.finish(args)
+
 if __name__ == "__main__":
     main()
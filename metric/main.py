@@ -1,11 +1,24 @@
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import tempfile
-import time
+import sys
 import os
-from distance.recognition import chord_recognition
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, scheduler as hop_scheduler
+from common.chroma import STREAM_TUNING_RATE, IncrementalChroma, TuningTracker
+from common.instrumentation import stage
+from common.ring_buffer import RingBuffer
+from distance.recognition import (
+    AnalysisPlan,
+    CausalMedianFilter,
+    chord_recognition,
+    chord_recognition_from_signal,
+    chord_recognition_parallel,
+    chord_recognition_stream,
+    compute_distance_matrix,
+    decode_chords,
+    get_template_bank
+)
 
 SR = 44100
 BUFFER_SECONDS = 2.0
@@ -14,68 +27,149 @@ HOP_SECONDS = 0.5
 BUFFER_SIZE = int(SR * BUFFER_SECONDS)
 HOP_SIZE = int(SR * HOP_SECONDS)
 
-audio_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
-write_ptr = 0
+WARMUP_SECONDS = 2.0
+
+# same analysis settings as compute_chromagram_stft
+FRAME_LENGTH = int(SR * 753 / 1000)
+CHROMA_HOP = int(SR * 93 / 1000)
+
+audio_buffer = RingBuffer(BUFFER_SIZE)
+
+# realtime state: only new frames are transformed, scored and filtered
+# (the chroma extractor is created by main(), it needs librosa)
+chroma_extractor = None
+bank = get_template_bank("majmin", num_harmonics=1)
+median = CausalMedianFilter(17)
 
 def audio_callback(indata, frames, time_info, status):
-    global audio_buffer
-    if status:
-        print(status)
+    audio_buffer.write(indata[:, 0])
 
-    samples = indata[:, 0]
-    n = len(samples)
-    audio_buffer[:] = np.roll(audio_buffer, -n)
-    audio_buffer[-n:] = samples
+    # xruns are counted by the scheduler instead of printed from the callback
+    scheduler.on_capture(status)
 
 def process_audio_buffer():
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        wav_path = tmp.name
-    sf.write(wav_path, audio_buffer, SR)
-
-    try:
-        chords = chord_recognition(
-            wav_path,
-            num_harmonics=1,
-            measure="EUC",
-            filtering="median",
-            L=17
-        )
-        if chords:
-            print(f"\r🎶 {chords[-1]:10s}", end="")
-    finally:
-        os.remove(wav_path)
+    with stage("hop"):
+        C = chroma_extractor.push(audio_buffer.read_new())
+        if C.shape[1] == 0:
+            return
+
+        N = C.shape[1]
+        C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
+        with stage("scoring", frames=N):
+            D = compute_distance_matrix(C, bank.matrix, "EUC", sq_norms=bank.sq_norms)
+        with stage("filtering", frames=N):
+            D = median.process(D)
+        with stage("decoding", frames=N):
+            idx = decode_chords(D)
+
+    label = bank.labels[idx[-1]]
+    print(f"\r🎶 {label:10s}", end="", flush=True)
+    return label
+
+scheduler = hop_scheduler.HopScheduler(process_audio_buffer, HOP_SECONDS)
+
+def warmup():
+    # run both pipelines once on a short dummy chord so the first hop does
+    # not pay for lazy imports, numba compilation and FFT setup
+    start = time.perf_counter()
+    t = np.arange(int(SR * WARMUP_SECONDS)) / SR
+    y = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)).astype(np.float32) / 3
+
+    chord_recognition_from_signal(y, SR)
+
+    C = IncrementalChroma(SR, FRAME_LENGTH, CHROMA_HOP).push(y)
+    D = compute_distance_matrix(C, bank.matrix, "EUC", sq_norms=bank.sq_norms)
+    decode_chords(CausalMedianFilter(17).process(D))
+
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s")
 
 def main():
+    global chroma_extractor
+
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", "-f", help="Path to audio WAV file")
+    parser.add_argument("--stream", action="store_true",
+                        help="With --file: read the file block by block and print segments as they are decided")
+    parser.add_argument("--jobs", "-j", type=int, default=1,
+                        help="With --file: analyze chunks of the file in this many threads (same labels)")
+    parser.add_argument("--chunk-seconds", type=float, default=60.0,
+                        help="Chunk length for --jobs")
+    parser.add_argument("--analysis-sr", type=int,
+                        help="With --file: resample to this rate before the STFT (e.g. 11025)")
+    parser.add_argument("--fast-fft", action="store_true",
+                        help="With --file: zero-pad frames to a fast FFT length")
+    parser.add_argument("--force-tuning", action="store_true",
+                        help="Re-estimate tuning on every call instead of once per file / slowly per stream")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Exercise the processing path on a dummy signal before capture starts")
+    hop_scheduler.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    instrumentation.configure(args)
+
+    plan = AnalysisPlan(analysis_sr=args.analysis_sr, fast_fft=args.fast_fft)
+
+    if args.file and args.stream:
+        print(f"📂 Streaming file: {args.file}")
+        for start, end, chord in chord_recognition_stream(
+                args.file, measure="KL2", filtering="LP+M", L=17, force_tuning=args.force_tuning, plan=plan
+        ):
+            print(f"{start:.2f} - {end:.2f}: {chord}", flush=True)
+        instrumentation.finish(args)
+        return
 
     if args.file:
         print(f"📂 Processing file: {args.file}")
-        chords = chord_recognition(
-            args.file,
-            num_harmonics=1,
-            measure="KL2",
-            filtering="LP+M",
-            L=17
-        )
+        if args.jobs > 1:
+            chords = chord_recognition_parallel(
+                args.file,
+                num_harmonics=1,
+                measure="KL2",
+                filtering="LP+M",
+                L=17,
+                workers=args.jobs,
+                chunk_seconds=args.chunk_seconds,
+                plan=plan,
+                force_tuning=args.force_tuning
+            )
+        else:
+            chords = chord_recognition(
+                args.file,
+                num_harmonics=1,
+                measure="KL2",
+                filtering="LP+M",
+                L=17,
+                plan=plan,
+                force_tuning=args.force_tuning
+            )
         for c in chords:
             print(c)
+        instrumentation.finish(args)
         return
 
+    import sounddevice as sd
+
+    chroma_extractor = IncrementalChroma(
+        SR, FRAME_LENGTH, CHROMA_HOP, tuning=TuningTracker(STREAM_TUNING_RATE, force=args.force_tuning)
+    )
+    if args.warmup:
+        warmup()
+
     print("🎤 Recording from microphone (Ctrl+C to exit)")
+    scheduler.policy = args.policy
     with sd.InputStream(
             channels=1,
             samplerate=SR,
             blocksize=HOP_SIZE,
             callback=audio_callback
-    ):
+    ) as stream:
+        scheduler.input_latency = stream.latency
         try:
-            while True:
-                time.sleep(HOP_SECONDS)
-                process_audio_buffer()
+            scheduler.run()
         except KeyboardInterrupt:
             print("\n🛑 Stopped.")
+    print(scheduler.format_stats())
+    instrumentation.finish(args)
 
 if __name__ == "__main__":
     main()
@@ -1,7 +1,48 @@
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache, partial
+
 import numpy as np
 import libfmp.c4
 import libfmp.c5
-from distance.recognition import chord_recognition
+
+# distance imports the shared top-level common package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from distance.recognition import ChromaCache, chord_recognition, get_template_bank
+
+# chromagrams of the dataset are reused across evaluation runs
+CHROMA_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".chroma_cache")
+
+
+@lru_cache(maxsize=None)
+def get_chord_labels():
+    return tuple(libfmp.c5.get_chord_labels(ext_minor='m'))
+
+
+@lru_cache(maxsize=None)
+def get_label_index(chord_labels):
+    return {
+        chord_labels[i]: i
+        for i in range(len(chord_labels))
+    }
+
+
+@lru_cache(maxsize=None)
+def load_annotation(annotation_path):
+
+    # the number of returned values differs between libfmp versions
+    ann_matrix = libfmp.c5.convert_chord_ann_matrix(
+        annotation_path,
+        list(get_chord_labels()),
+        Fs=1,
+        N=None,
+        last=False
+    )[0]
+    ann_matrix.flags.writeable = False
+
+    return ann_matrix
 
 
 def convert_labels_to_matrix(labels, chord_labels):
@@ -11,10 +52,7 @@ def convert_labels_to_matrix(labels, chord_labels):
 
     chord_matrix = np.zeros((K, N))
 
-    label_to_index = {
-        chord_labels[i]: i
-        for i in range(K)
-    }
+    label_to_index = get_label_index(tuple(chord_labels))
 
     for n, label in enumerate(labels):
 
@@ -34,22 +72,28 @@ def convert_labels_to_matrix(labels, chord_labels):
 def evaluate_song_with_your_method(
         audio_path,
         annotation_path,
-        chord_recognition_func
+        chord_recognition_func,
+        verbose=True
 ):
 
-    print("\nProcessing:", audio_path)
+    if verbose:
+        print("\nProcessing:", audio_path)
 
-    chord_labels = libfmp.c5.get_chord_labels(ext_minor='m')
+    predicted_labels = chord_recognition_func(audio_path)
 
-    ann_matrix, _ = libfmp.c5.convert_chord_ann_matrix(
-        annotation_path,
-        chord_labels,
-        Fs=1,
-        N=None,
-        last=False
-    )
+    result = score_labels(predicted_labels, annotation_path)
 
-    predicted_labels = chord_recognition_func(audio_path)
+    if verbose:
+        print_song_result(result)
+
+    return result
+
+
+def score_labels(predicted_labels, annotation_path):
+
+    chord_labels = get_chord_labels()
+
+    ann_matrix = load_annotation(annotation_path)
 
     chord_matrix = convert_labels_to_matrix(
         predicted_labels,
@@ -64,36 +108,97 @@ def evaluate_song_with_your_method(
     ann_matrix = ann_matrix[:, :N]
     chord_matrix = chord_matrix[:, :N]
 
-    result = libfmp.c5.compute_eval_measures(
+    return libfmp.c5.compute_eval_measures(
         ann_matrix,
         chord_matrix
     )
 
+
+def print_song_result(result):
+
     P, R, F, TP, FP, FN = result
 
     print("Precision:", round(P, 3))
     print("Recall:", round(R, 3))
     print("F-measure:", round(F, 3))
 
-    return result
 
+def init_worker():
+
+    # per-process warm state: label tables and the default template bank
+    get_chord_labels()
+    get_label_index(get_chord_labels())
+    get_template_bank()
+
+
+def bound_cache(chord_recognition_func):
+
+    # the ChromaCache of a partial(chord_recognition, cache=...), if any
+    return getattr(chord_recognition_func, "keywords", {}).get("cache")
+
+
+def evaluate_song_job(args):
+
+    audio_path, annotation_path, chord_recognition_func = args
+
+    # the worker uses its own copy of the cache: report its hits and
+    # misses so the parent can count them
+    cache = bound_cache(chord_recognition_func)
+    before = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    result = evaluate_song_with_your_method(
+        audio_path,
+        annotation_path,
+        chord_recognition_func,
+        verbose=False
+    )
 
-def evaluate_dataset(song_dict, chord_recognition_func):
+    after = (cache.hits, cache.misses) if cache is not None else (0, 0)
+
+    return result, after[0] - before[0], after[1] - before[1]
+
+
+def evaluate_dataset(song_dict, chord_recognition_func, workers=1):
 
     results = []
 
-    for s in song_dict:
+    jobs = [
+        (song_dict[s][2], song_dict[s][3], chord_recognition_func)
+        for s in song_dict
+    ]
+
+    workers = min(workers, len(jobs))
+
+    if workers > 1:
+
+        cache = bound_cache(chord_recognition_func)
+
+        # chord_recognition_func must be picklable (module-level or partial)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker) as pool:
+
+            # map() yields in input order
+            for (audio_path, _, _), (result, hits, misses) in zip(jobs, pool.map(evaluate_song_job, jobs)):
 
-        audio_path = song_dict[s][2]
-        annotation_path = song_dict[s][3]
+                print("\nProcessing:", audio_path)
+                print_song_result(result)
 
-        result = evaluate_song_with_your_method(
-            audio_path,
-            annotation_path,
-            chord_recognition_func
-        )
+                results.append(result[2])
 
-        results.append(result[2])
+                if cache is not None:
+                    cache.hits += hits
+                    cache.misses += misses
+
+    else:
+
+        for audio_path, annotation_path, _ in jobs:
+
+            result = evaluate_song_with_your_method(
+                audio_path,
+                annotation_path,
+                chord_recognition_func
+            )
+
+            results.append(result[2])
 
     print("\n==========================")
     print("FINAL RESULT")
@@ -142,7 +247,17 @@ song_dict[3] = [
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (1 = serial)")
+    args = parser.parse_args()
+
+    cache = ChromaCache(CHROMA_CACHE_DIR)
+
     evaluate_dataset(
         song_dict,
-        chord_recognition
+        partial(chord_recognition, cache=cache),
+        workers=args.workers
     )
+
+    print("Chroma cache:", cache.stats)
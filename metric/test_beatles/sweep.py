@@ -0,0 +1,164 @@
+"""
+Parameter sweep over num_harmonics x measure x filtering x L.
+
+Work is shared along the grid: every song's chromagram is computed once
+(and taken from the chroma cache when available), every distance matrix
+once per (num_harmonics, measure), and only filtering and decoding run
+for each filter setting.
+
+Run from the metric directory:
+
+    python -m test_beatles.sweep --harmonics 1 4 --measures KL2 EUC \\
+        --filterings none lowpass median LP+M --L 9 17 --out sweep.csv
+"""
+import argparse
+import csv
+import os
+import sys
+import time
+from collections import defaultdict
+
+import numpy as np
+
+# distance imports the shared top-level common package
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", ".."))
+from distance.recognition import (
+    ChromaCache,
+    apply_filtering,
+    compute_chromagram,
+    decode_chords,
+    get_template_bank,
+    recognize_chords_framewise,
+)
+from test_beatles.evaluation import CHROMA_CACHE_DIR, score_labels, song_dict
+
+# filterings whose result depends on L; "LP+M" uses its own fixed lengths
+FILTERINGS_WITH_L = ("lowpass", "median")
+
+
+def filter_settings(filterings, Ls):
+    for filtering in filterings:
+        if filtering in FILTERINGS_WITH_L:
+            for L in Ls:
+                yield filtering, L
+        else:
+            yield filtering, None
+
+
+def run_sweep(
+    song_dict,
+    num_harmonics=(1,),
+    measures=("KL2", "EUC"),
+    filterings=("none", "lowpass", "median", "LP+M"),
+    Ls=(17,),
+    vocabulary="majmin",
+    cache=None
+):
+    """
+    Returns (rows, chroma_seconds): one row per configuration with the
+    mean precision / recall / F-measure over the songs and the total time
+    spent in distance scoring and in filtering + decoding, plus the total
+    chromagram time (shared by every configuration).
+    """
+    scores = defaultdict(list)
+    times = defaultdict(lambda: {"distance_s": 0.0, "filter_decode_s": 0.0})
+    chroma_seconds = 0.0
+
+    for s in song_dict:
+
+        audio_path = song_dict[s][2]
+        annotation_path = song_dict[s][3]
+
+        start = time.perf_counter()
+        C = compute_chromagram(audio_path, cache=cache)
+        chroma_seconds += time.perf_counter() - start
+
+        for nh in num_harmonics:
+
+            bank = get_template_bank(vocabulary, nh)
+
+            for measure in measures:
+
+                start = time.perf_counter()
+                chord_names, D = recognize_chords_framewise(C, bank, measure)
+                distance_s = time.perf_counter() - start
+
+                for filtering, L in filter_settings(filterings, Ls):
+
+                    key = (nh, measure, filtering, L)
+                    times[key]["distance_s"] += distance_s
+
+                    start = time.perf_counter()
+                    idx = decode_chords(apply_filtering(D, filtering, L))
+                    times[key]["filter_decode_s"] += time.perf_counter() - start
+
+                    labels = [chord_names[i] for i in idx]
+                    P, R, F, _, _, _ = score_labels(labels, annotation_path)
+                    scores[key].append((P, R, F))
+
+    rows = []
+    for key, values in scores.items():
+        nh, measure, filtering, L = key
+        P, R, F = np.mean(values, axis=0)
+        rows.append({
+            "num_harmonics": nh,
+            "measure": measure,
+            "filtering": filtering,
+            "L": "" if L is None else L,
+            "precision": round(P, 4),
+            "recall": round(R, 4),
+            "f_measure": round(F, 4),
+            "distance_s": round(times[key]["distance_s"], 4),
+            "filter_decode_s": round(times[key]["filter_decode_s"], 4),
+        })
+
+    rows.sort(key=lambda r: r["f_measure"], reverse=True)
+    return rows, chroma_seconds
+
+
+def print_table(rows):
+    columns = list(rows[0].keys())
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for r in rows:
+        print("  ".join(str(r[c]).ljust(w) for c, w in zip(columns, widths)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--harmonics", type=int, nargs="+", default=[1])
+    parser.add_argument("--measures", nargs="+", default=["KL2", "EUC"])
+    parser.add_argument("--filterings", nargs="+", default=["none", "lowpass", "median", "LP+M"])
+    parser.add_argument("--L", type=int, nargs="+", default=[17])
+    parser.add_argument("--vocabulary", default="majmin")
+    parser.add_argument("--out", "-o", help="Write the results table as CSV")
+    parser.add_argument("--no-cache", action="store_true", help="Do not use the chroma cache")
+    args = parser.parse_args()
+
+    cache = None if args.no_cache else ChromaCache(CHROMA_CACHE_DIR)
+
+    rows, chroma_seconds = run_sweep(
+        song_dict,
+        num_harmonics=args.harmonics,
+        measures=args.measures,
+        filterings=args.filterings,
+        Ls=args.L,
+        vocabulary=args.vocabulary,
+        cache=cache
+    )
+
+    print(f"Chromagrams: {len(song_dict)} songs, {chroma_seconds:.2f} s (shared by all configurations)")
+    if cache is not None:
+        print("Chroma cache:", cache.stats)
+    print_table(rows)
+
+    if args.out:
+        with open(args.out, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=list(rows[0].keys()))
+            writer.writeheader()
+            writer.writerows(rows)
+        print("Results written to", os.path.abspath(args.out))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,16 @@
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import tempfile
-import time
+import sys
 import os
-import threading
-
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, scheduler as hop_scheduler
+from common.instrumentation import stage
+from common.ring_buffer import RingBuffer
+from math import gcd
 
-from madmom.features.chords import (
-    CNNChordFeatureProcessor,
-    CRFChordRecognitionProcessor
-)
+# madmom, scipy and sounddevice are imported only where a mode needs them
 
 SR = 44100
 BUFFER_SECONDS = 2.0
@@ -20,60 +19,95 @@ HOP_SECONDS = 0.5
 BUFFER_SIZE = int(SR * BUFFER_SECONDS)
 HOP_SIZE = int(SR * HOP_SECONDS)
 
-audio_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
-buffer_lock = threading.Lock()
+WARMUP_SECONDS = 2.0
 
-# initialize madmom processors ONCE (important for speed)
-cnn_processor = CNNChordFeatureProcessor()
-crf_processor = CRFChordRecognitionProcessor()
+audio_buffer = RingBuffer(BUFFER_SIZE)
 
+AUDIO_EXTENSIONS = (".wav", ".flac", ".mp3", ".ogg", ".m4a", ".aif", ".aiff")
+
+# madmom processors, loaded ONCE per process (important for speed)
+cnn_processor = None
+crf_processor = None
 
-def audio_callback(indata, frames, time_info, status):
-    global audio_buffer
 
-    if status:
-        print(status)
+def load_processors():
+    global cnn_processor, crf_processor
 
-    samples = indata[:, 0]
-    n = len(samples)
+    if cnn_processor is None:
+        from madmom.features.chords import (
+            CNNChordFeatureProcessor,
+            CRFChordRecognitionProcessor
+        )
 
-    with buffer_lock:
-        audio_buffer[:] = np.roll(audio_buffer, -n)
-        audio_buffer[-n:] = samples
+        cnn_processor = CNNChordFeatureProcessor()
+        crf_processor = CRFChordRecognitionProcessor()
 
 
+def audio_callback(indata, frames, time_info, status):
+    audio_buffer.write(indata[:, 0])
+
+    # xruns are counted by the scheduler instead of printed from the callback
+    scheduler.on_capture(status)
+
 def recognize_chords(wav_path):
-    features = cnn_processor(wav_path)
-    chords = crf_processor(features)
+    from madmom.audio.signal import Signal
+
+    with stage("load"):
+        signal = Signal(wav_path, sample_rate=SR, num_channels=1)
+    return recognize_chords_signal(signal, signal.sample_rate)
+
+
+def recognize_chords_signal(y, sr):
+    from madmom.audio.signal import Signal
+
+    load_processors()
+
+    # madmom's models run at 44.1 kHz; a Signal is not resampled on input
+    if sr != SR:
+        from scipy.signal import resample_poly
+
+        with stage("resample"):
+            g = gcd(SR, sr)
+            y = resample_poly(y, SR // g, sr // g).astype(np.float32)
+
+    with stage("features"):
+        features = cnn_processor(Signal(y, sample_rate=SR, num_channels=1))
+    with stage("decoding", frames=len(features)):
+        chords = crf_processor(features)
     return chords
 
 
 def process_audio_buffer():
     # copy buffer safely
-    with buffer_lock:
-        buffer_copy = audio_buffer.copy()
-
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        wav_path = tmp.name
-
-    sf.write(wav_path, buffer_copy, SR)
+    buffer_copy = audio_buffer.latest()
 
     try:
-        chords = recognize_chords(wav_path)
+        with stage("hop"):
+            chords = recognize_chords_signal(buffer_copy, SR)
 
         # FIX: proper numpy array check
         if chords is not None and len(chords) > 0:
             last_chord = chords[-1][2]
             print(f"\r🎶 {last_chord:10s}", end="", flush=True)
+            return last_chord
 
     except Exception as e:
         print(f"\nError: {e}")
 
-    finally:
-        try:
-            os.remove(wav_path)
-        except:
-            pass
+
+scheduler = hop_scheduler.HopScheduler(process_audio_buffer, HOP_SECONDS)
+
+
+def warmup():
+    # build the processors and run them on a dummy chord so the first hop
+    # does not pay for the model load
+    start = time.perf_counter()
+    t = np.arange(int(SR * WARMUP_SECONDS)) / SR
+    y = (sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3).astype(np.float32)
+
+    recognize_chords_signal(y, SR)
+
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s")
 
 
 def process_file(path):
@@ -89,33 +123,168 @@ def process_file(path):
         print("No chords detected")
 
 
+def collect_audio_files(paths):
+    """
+    (path, name) pairs; name is the path relative to the directory
+    argument it was found in (the basename for file arguments) and is
+    used for the output .lab file.
+    """
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in sorted(os.walk(path)):
+                files.extend(
+                    (os.path.join(root, name), os.path.relpath(os.path.join(root, name), path))
+                    for name in sorted(names)
+                    if name.lower().endswith(AUDIO_EXTENSIONS)
+                )
+        else:
+            files.append((path, os.path.basename(path)))
+    return files
+
+
+def lab_paths(files, out_dir):
+    # one .lab per input, mirroring the directory layout; inputs that
+    # would share a .lab file (x.wav and x.flac) are an error
+    labs = {}
+    for path, name in files:
+        lab = os.path.join(out_dir, os.path.splitext(name)[0] + ".lab")
+        if lab in labs:
+            raise ValueError(f"{labs[lab]} and {path} would both be written to {lab}")
+        labs[lab] = path
+    return {path: lab for lab, path in labs.items()}
+
+
+def transcribe_job(path):
+    # runs in a pool worker; errors are returned so one bad file does not stop the batch
+    from madmom.audio.signal import Signal
+
+    start = time.perf_counter()
+    try:
+        signal = Signal(path, sample_rate=SR, num_channels=1)
+        chords = recognize_chords_signal(signal, signal.sample_rate)
+        return path, chords, len(signal) / signal.sample_rate, time.perf_counter() - start, None
+    except Exception as e:
+        return path, None, 0.0, time.perf_counter() - start, f"{type(e).__name__}: {e}"
+
+
+def write_lab(chords, path):
+    with open(path, "w") as f:
+        for start, end, label in chords:
+            f.write(f"{start:.3f}\t{end:.3f}\t{label}\n")
+
+
+def process_batch(paths, workers=None, out_dir=None):
+    files = collect_audio_files(paths)
+    if not files:
+        print("No audio files found")
+        return
+
+    labs = None
+    if out_dir:
+        try:
+            labs = lab_paths(files, out_dir)
+        except ValueError as e:
+            sys.exit(f"Output name collision: {e}")
+
+    workers = min(workers or os.cpu_count(), len(files))
+    print(f"📚 Transcribing {len(files)} files with {workers} workers")
+
+    start = time.perf_counter()
+    audio_seconds = 0.0
+    failed = 0
+
+    # the processors are loaded once in each worker, not once per file
+    with ProcessPoolExecutor(max_workers=workers, initializer=load_processors) as pool:
+        futures = [pool.submit(transcribe_job, path) for path, _ in files]
+
+        # results are printed in completion order
+        for done, future in enumerate(as_completed(futures), 1):
+            path, chords, duration, elapsed, error = future.result()
+
+            # stages run in the workers and are not collected here; record
+            # the per-file time the worker measured instead
+            if instrumentation.recorder.enabled:
+                end = time.perf_counter_ns()
+                instrumentation.recorder.record("file", end - int(elapsed * 1e9), end)
+
+            if error is not None:
+                failed += 1
+                instrumentation.count("failed")
+                print(f"[{done}/{len(files)}] {path}: FAILED ({error})")
+                continue
+
+            audio_seconds += duration
+            print(f"[{done}/{len(files)}] {path}: {len(chords)} segments, "
+                  f"{duration:.1f} s audio in {elapsed:.1f} s", flush=True)
+
+            if labs is not None:
+                os.makedirs(os.path.dirname(labs[path]), exist_ok=True)
+                write_lab(chords, labs[path])
+            else:
+                for seg_start, seg_end, label in chords:
+                    print(f"    {seg_start:.2f} - {seg_end:.2f}: {label}")
+
+    minutes = (time.perf_counter() - start) / 60
+    print(f"\nDone: {len(files) - failed} files ({failed} failed) in {minutes * 60:.1f} s")
+    print(f"Throughput: {(len(files) - failed) / minutes:.1f} files/min, "
+          f"{audio_seconds / 3600 / minutes:.3f} audio-hours/min")
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", "-f", help="Path to audio file")
+    parser.add_argument("--batch", "-b", nargs="+", metavar="PATH",
+                        help="Audio files and/or directories to transcribe in a process pool")
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Number of worker processes for --batch")
+    parser.add_argument("--out-dir", "-o",
+                        help="Write one .lab file per input here instead of printing the chords")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Load the processors and run them on a dummy signal before capture starts")
+    hop_scheduler.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    instrumentation.configure(args)
+
+    if args.batch:
+        process_batch(args.batch, args.workers, args.out_dir)
+        instrumentation.finish(args)
+        return
 
     if args.file:
         print(f"📂 Processing file: {args.file}")
         process_file(args.file)
+        instrumentation.finish(args)
         return
 
+    import sounddevice as sd
+
+    if args.warmup:
+        warmup()
+
     print("🎤 Recording from microphone (Ctrl+C to exit)")
 
+    scheduler.policy = args.policy
+
     with sd.InputStream(
         channels=1,
         samplerate=SR,
         blocksize=HOP_SIZE,
         callback=audio_callback,
         dtype=np.float32
-    ):
+    ) as stream:
+        scheduler.input_latency = stream.latency
         try:
-            while True:
-                time.sleep(HOP_SECONDS)
-                process_audio_buffer()
+            scheduler.run()
 
         except KeyboardInterrupt:
             print("\n🛑 Stopped.")
 
+    print(scheduler.format_stats())
+
+    instrumentation.finish(args)
+
 
 if __name__ == "__main__":
     main()
@@ -4,13 +4,16 @@ os.environ["VAMP_PATH"] = r"C:\common\University\Диплом\chord_recognition_
 
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import tempfile
+import sys
 import time
-import os
-import threading
-from omnizart.chord.app import ChordTranscription
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, scheduler as hop_scheduler
+from common.instrumentation import stage
+from common.ring_buffer import RingBuffer
+from math import gcd
+
+# omnizart (TensorFlow), vamp, scipy and sounddevice are imported only
+# where a mode needs them
 
 SR = 44100
 BUFFER_SECONDS = 2.0
@@ -19,26 +22,55 @@ HOP_SECONDS = 0.5
 BUFFER_SIZE = int(SR * BUFFER_SECONDS)
 HOP_SIZE = int(SR * HOP_SECONDS)
 
-audio_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
-buffer_lock = threading.Lock()
+WARMUP_SECONDS = 2.0
 
-# initialize omnizart model once
-chord_model = ChordTranscription()
+audio_buffer = RingBuffer(BUFFER_SIZE)
 
+# omnizart model, loaded once on first use
+chord_model = None
+keras_model = None
+model_settings = None
 
-def audio_callback(indata, frames, time_info, status):
-    global audio_buffer
 
-    if status:
-        print(status)
+def load_model():
+    global chord_model, keras_model, model_settings
+
+    if keras_model is not None:
+        return
+
+    from omnizart.chord.app import ChordTranscription
+
+    chord_model = ChordTranscription()
+
+    # ChordTranscription.transcribe() reloads the network on every call and
+    # only accepts a file path, so keep the loaded model here and run the
+    # same feature -> predict -> inference steps on in-memory audio.
+    # _load_model is private omnizart API: pinned in requirements-venv38.txt
+    keras_model, model_settings = chord_model._load_model(
+        None, custom_objects=chord_model.custom_objects
+    )
+
+
+def nnls_chroma_params():
+    # private omnizart constants, pinned in requirements-venv38.txt
+    from omnizart.feature.chroma import CHROMA_NORM, TUNING_MODE
+
+    # defaults of omnizart.feature.chroma.extract_chroma
+    return {
+        "useNNLS": 0,
+        "rollon": 1,
+        "tuningmode": TUNING_MODE["global"],
+        "whitening": 1,
+        "s": 0.7,
+        "chromanormalize": CHROMA_NORM["none"]
+    }
 
-    samples = indata[:, 0]
 
-    with buffer_lock:
-        n = len(samples)
-        audio_buffer[:-n] = audio_buffer[n:]
-        audio_buffer[-n:] = samples
+def audio_callback(indata, frames, time_info, status):
+    audio_buffer.write(indata[:, 0])
 
+    # xruns are counted by the scheduler instead of printed from the callback
+    scheduler.on_capture(status)
 
 def recognize_chords_file(path):
     """
@@ -46,11 +78,52 @@ def recognize_chords_file(path):
     Returns list of (start, end, chord)
     """
 
-    result = chord_model.transcribe(path)
+    from omnizart.io import load_audio
+
+    with stage("load"):
+        y, sr = load_audio(path, sampling_rate=SR)
+
+    return recognize_chords_signal(y, sr)
+
+
+def recognize_chords_signal(y, sr):
+    """
+    Omnizart chord recognition from a mono float signal
+    Returns list of (start, end, chord)
+    """
+
+    import vamp
+    from omnizart.chord.inference import inference
+
+    load_model()
+
+    if sr != SR:
+        from scipy.signal import resample_poly
+
+        with stage("resample"):
+            g = gcd(SR, sr)
+            y = resample_poly(y, SR // g, sr // g)
+            sr = SR
+
+    with stage("chroma"):
+        step_size, chroma = vamp.collect(
+            y, sr, "nnls-chroma:nnls-chroma",
+            output="bothchroma", parameters=nnls_chroma_params()
+        )["matrix"]
+
+    with stage("predict", frames=len(chroma)):
+        chord_pred = predict_chords(chroma)
+
+    with stage("decoding", frames=len(chroma)):
+        _, info = inference(
+            chord_pred,
+            step_size.to_float(),
+            min_dura=model_settings.inference.min_dura
+        )
 
     chords = []
 
-    for item in result:
+    for item in info:
         start = item["start"]
         end = item["end"]
         chord = item["chord"]
@@ -60,30 +133,58 @@ def recognize_chords_file(path):
     return chords
 
 
-def process_audio_buffer():
-    with buffer_lock:
-        buffer_copy = audio_buffer.copy()
+def predict_chords(chroma):
+    # segment preparation from ChordTranscription.transcribe()
+    segment_width = model_settings.feature.segment_width
+    pad_size = segment_width // 2
+
+    chroma_pad = np.pad(chroma, ((pad_size, pad_size), (0, 0)), constant_values=0)
+    segments = np.array([
+        chroma_pad[i - pad_size:i + pad_size + 1]
+        for i in range(pad_size, pad_size + len(chroma))
+    ])
+    segments = segments.reshape([-1, chroma.shape[1] * segment_width])
 
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
-        wav_path = tmp.name
+    num_steps = model_settings.feature.num_steps
+    pad_end = num_steps - len(segments) % num_steps
+    segments_pad = np.pad(segments, ((0, pad_end), (0, 0)), constant_values=0)
 
-    sf.write(wav_path, buffer_copy, SR)
+    num_seqs = len(segments_pad) // num_steps
+    segments_pad = segments_pad.reshape([num_seqs, num_steps, segments_pad.shape[1]])
+
+    chord, _, _, _ = keras_model.predict(segments_pad)
+    return chord.reshape(np.prod(chord.shape))[:-pad_end]
+
+
+def process_audio_buffer():
+    buffer_copy = audio_buffer.latest()
 
     try:
-        chords = recognize_chords_file(wav_path)
+        with stage("hop"):
+            chords = recognize_chords_signal(buffer_copy, SR)
 
         if chords:
             last_chord = chords[-1][2]
             print(f"\r🎶 {last_chord:10s}", end="", flush=True)
+            return last_chord
 
     except Exception as e:
         print(f"\nError: {e}")
 
-    finally:
-        try:
-            os.remove(wav_path)
-        except:
-            pass
+
+scheduler = hop_scheduler.HopScheduler(process_audio_buffer, HOP_SECONDS)
+
+
+def warmup():
+    # load the network and run one prediction on a dummy chord so the first
+    # hop does not pay for the model load and TensorFlow graph tracing
+    start = time.perf_counter()
+    t = np.arange(int(SR * WARMUP_SECONDS)) / SR
+    y = (sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3).astype(np.float32)
+
+    recognize_chords_signal(y, SR)
+
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s")
 
 
 def process_file(path):
@@ -100,30 +201,46 @@ def process_file(path):
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--file", "-f", help="Path to audio file")
+    parser.add_argument("--warmup", action="store_true",
+                        help="Load the model and run it on a dummy signal before capture starts")
+    hop_scheduler.add_arguments(parser)
+    instrumentation.add_arguments(parser)
     args = parser.parse_args()
+    instrumentation.configure(args)
 
     if args.file:
         print(f"📂 Processing file: {args.file}")
         process_file(args.file)
+        instrumentation.finish(args)
         return
 
+    import sounddevice as sd
+
+    if args.warmup:
+        warmup()
+
     print("🎤 Omnizart realtime chord recognition (Ctrl+C to exit)")
 
+    scheduler.policy = args.policy
+
     with sd.InputStream(
         channels=1,
         samplerate=SR,
         blocksize=HOP_SIZE,
         callback=audio_callback,
         dtype=np.float32
-    ):
+    ) as stream:
+        scheduler.input_latency = stream.latency
         try:
-            while True:
-                time.sleep(HOP_SECONDS)
-                process_audio_buffer()
+            scheduler.run()
 
         except KeyboardInterrupt:
             print("\n🛑 Stopped.")
 
+    print(scheduler.format_stats())
+
+    instrumentation.finish(args)
+
 
 if __name__ == "__main__":
     main()
@@ -1,13 +1,16 @@
 import argparse
 import numpy as np
-import sounddevice as sd
-import soundfile as sf
-import tempfile
-import time
+import sys
 import os
-import threading
-import librosa
-from scipy.special import softmax
+import time
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common import instrumentation, scheduler as hop_scheduler
+from common.chroma import STREAM_TUNING_RATE, IncrementalChroma, TuningTracker, file_tuning, power_to_chroma
+from common.instrumentation import stage
+from common.ring_buffer import RingBuffer
+from collections import deque
+
+# librosa, scipy and sounddevice are imported only where a mode needs them
 
 # ==========================
 # CONFIG
@@ -20,8 +23,14 @@ HOP_SECONDS = 0.5
 BUFFER_SIZE = int(SR * BUFFER_SECONDS)
 HOP_SIZE = int(SR * HOP_SECONDS)
 
-audio_buffer = np.zeros(BUFFER_SIZE, dtype=np.float32)
-buffer_lock = threading.Lock()
+WARMUP_SECONDS = 1.0
+
+CHROMA_HOP = 512
+
+# realtime decisions are delayed by this many chroma frames
+DECODER_LAG = 8
+
+audio_buffer = RingBuffer(BUFFER_SIZE)
 
 # ==========================
 # CHORD TEMPLATES (24 chords + N)
@@ -67,36 +76,46 @@ np.fill_diagonal(A, TRANSITION_PROB)
 
 PI = np.ones(N_CHORDS) / N_CHORDS
 
+# log-space parameters, computed once
+LOG_A = np.log(A)
+LOG_PI = np.log(PI)
+
+# A is "stay" on the diagonal and one shared "switch" value elsewhere
+LOG_STAY = np.log(TRANSITION_PROB)
+LOG_SWITCH = np.log((1-TRANSITION_PROB)/(N_CHORDS-1))
+
 # ==========================
 # AUDIO CALLBACK
 # ==========================
 
 def audio_callback(indata, frames, time_info, status):
 
-    if status:
-        print(status)
-
-    samples = indata[:,0]
+    audio_buffer.write(indata[:, 0])
 
-    with buffer_lock:
-
-        n = len(samples)
-
-        audio_buffer[:-n] = audio_buffer[n:]
-        audio_buffer[-n:] = samples
+    # xruns are counted by the scheduler instead of printed from the callback
+    scheduler.on_capture(status)
 
 # ==========================
 # FEATURE EXTRACTION
 # ==========================
 
-def extract_chroma(y):
+def extract_chroma(y, tuning=None):
+
+    # tuning: a value or TuningTracker; None estimates it from y
+
+    import librosa
+
+    S = np.abs(librosa.stft(y, n_fft=2048, hop_length=CHROMA_HOP)) ** 2
+
+    # cached filter bank: the chroma step is one matrix product
+    chroma = power_to_chroma(S, SR, tuning)
+
+    return normalize_chroma(chroma)
 
-    chroma = librosa.feature.chroma_stft(
-        y=y,
-        sr=SR,
-        n_fft=2048,
-        hop_length=512
-    )
+
+def normalize_chroma(chroma):
+
+    # (12, T) chroma -> (T, 12) unit-norm frames
 
     chroma = chroma.T
 
@@ -110,61 +129,239 @@ def extract_chroma(y):
 
 def compute_emission(chroma):
 
+    from scipy.special import softmax
+
     sim = chroma @ TEMPLATES.T
 
     emission = softmax(sim, axis=1)
 
     return emission
 
+
+def compute_emissions(chromas):
+
+    # batched compute_emission for several streams: the new (T_s, 12)
+    # frames of all streams share one product and one softmax call, and
+    # are split back per stream (decoder state stays per stream)
+
+    if not chromas:
+
+        return []
+
+    sizes = [len(chroma) for chroma in chromas]
+
+    emission = compute_emission(np.concatenate(chromas))
+
+    return np.split(emission, np.cumsum(sizes)[:-1])
+
 # ==========================
 # VITERBI
 # ==========================
 
 def viterbi(emission):
 
-    T = emission.shape[0]
+    log_emission = np.log(emission)
+
+    if N_CHORDS > 1:
+        return viterbi_uniform(log_emission, LOG_STAY, LOG_SWITCH, LOG_PI)
+
+    return viterbi_dense(log_emission, LOG_A, LOG_PI)
+
+
+def viterbi_dense(log_emission, log_A, log_pi):
+
+    T, K = log_emission.shape
+
+    ptr = np.zeros((T, K), dtype=int)
 
-    dp = np.zeros((T, N_CHORDS))
-    ptr = np.zeros((T, N_CHORDS), dtype=int)
+    dp = log_pi + log_emission[0]
 
-    dp[0] = np.log(PI) + np.log(emission[0])
+    for t in range(1, T):
+
+        # scores[i, j] = dp[i] + log A[i, j]
+        scores = dp[:, None] + log_A
+
+        ptr[t] = np.argmax(scores, axis=0)
+
+        dp = scores[ptr[t], np.arange(K)] + log_emission[t]
+
+    return backtrack(dp, ptr)
+
+
+def viterbi_uniform(log_emission, log_stay, log_switch, log_pi):
+
+    T, K = log_emission.shape
+
+    states = np.arange(K)
+
+    ptr = np.zeros((T, K), dtype=int)
+
+    dp = log_pi + log_emission[0]
 
     for t in range(1, T):
 
-        for j in range(N_CHORDS):
+        dp, ptr[t] = uniform_step(dp, log_stay, log_switch, states)
+
+        dp += log_emission[t]
+
+    return backtrack(dp, ptr)
+
+
+def uniform_step(dp, log_stay, log_switch, states):
+
+    # With a uniform off-diagonal A the best predecessor of j is either j
+    # itself or the best state other than j, so each step is O(K).
+
+    best = np.argmax(dp)
 
-            prob = dp[t-1] + np.log(A[:,j])
+    second = np.argmax(np.where(states == best, -np.inf, dp))
 
-            ptr[t,j] = np.argmax(prob)
+    other = np.where(states == best, second, best)
 
-            dp[t,j] = np.max(prob) + np.log(emission[t,j])
+    stay = dp + log_stay
+
+    switch = dp[other] + log_switch
+
+    # ties go to the lower index, like argmax over the full column
+    take_stay = (stay > switch) | ((stay == switch) & (states < other))
+
+    return np.where(take_stay, stay, switch), np.where(take_stay, states, other)
+
+
+def backtrack(dp_last, ptr):
+
+    T = ptr.shape[0]
 
     path = np.zeros(T, dtype=int)
 
-    path[-1] = np.argmax(dp[-1])
+    path[-1] = np.argmax(dp_last)
 
     for t in reversed(range(T-1)):
         path[t] = ptr[t+1, path[t+1]]
 
     return path
 
+
+class OnlineViterbi:
+
+    """
+    Fixed-lag Viterbi decoder that keeps its state across realtime hops.
+
+    push() takes only the new log-emission frames and returns the states
+    decided for frames that are now `lag` frames old. The log-probability
+    vector and a window of `lag` backpointers are carried between calls,
+    so each frame costs O(K + lag) no matter how long the stream runs.
+    """
+
+    def __init__(self, lag=DECODER_LAG, log_stay=LOG_STAY, log_switch=LOG_SWITCH, log_pi=LOG_PI):
+
+        self.lag = lag
+        self.log_stay = log_stay
+        self.log_switch = log_switch
+        self.log_pi = log_pi
+
+        self.states = np.arange(len(log_pi))
+
+        self.reset()
+
+    def reset(self):
+
+        self.dp = None
+        self.ptr = deque(maxlen=max(self.lag, 1))
+        self.frames = 0
+
+    def push(self, log_emission):
+
+        decided = []
+
+        for frame in np.atleast_2d(log_emission):
+
+            if self.dp is None:
+
+                dp = self.log_pi + frame
+
+            else:
+
+                dp, ptr = uniform_step(self.dp, self.log_stay, self.log_switch, self.states)
+
+                dp += frame
+
+                self.ptr.append(ptr)
+
+            # keep the scores bounded on endless streams
+            self.dp = dp - dp.max()
+
+            self.frames += 1
+
+            if self.frames > self.lag:
+                decided.append(self._trace(self.lag))
+
+        return np.array(decided, dtype=int)
+
+    def flush(self):
+
+        # decide the frames still inside the lag window (end of stream)
+        pending = min(self.lag, self.frames)
+
+        decided = [self._trace(d) for d in range(pending - 1, -1, -1)]
+
+        self.reset()
+
+        return np.array(decided, dtype=int)
+
+    def _trace(self, depth):
+
+        state = np.argmax(self.dp)
+
+        for t in range(1, depth + 1):
+            state = self.ptr[-t][state]
+
+        return state
+
 # ==========================
 # CHORD RECOGNITION
 # ==========================
 
-def recognize_chords(wav_path):
+def recognize_chords(wav_path, force_tuning=False):
+
+    import librosa
+
+    with stage("load"):
+
+        y, sr = librosa.load(wav_path, sr=SR)
+
+    # tuning is estimated once per file from extract_chroma's spectrogram
+    tuning = file_tuning(wav_path, ("librosa.stft", SR, 2048, CHROMA_HOP), force_tuning)
+
+    return recognize_chords_signal(y, sr, tuning)
+
+
+def recognize_chords_signal(y, sr, tuning=None):
+
+    if sr != SR:
+
+        import librosa
+
+        with stage("resample"):
+
+            y = librosa.resample(y, orig_sr=sr, target_sr=SR)
+
+    # extract_chroma runs the STFT and the chroma folding together
+    with stage("stft+chroma"):
+
+        chroma = extract_chroma(y, tuning)
 
-    y, sr = librosa.load(wav_path, sr=SR)
+    with stage("scoring", frames=len(chroma)):
 
-    chroma = extract_chroma(y)
+        emission = compute_emission(chroma)
 
-    emission = compute_emission(chroma)
+    with stage("decoding", frames=len(chroma)):
 
-    path = viterbi(emission)
+        path = viterbi(emission)
 
     chords = []
 
-    hop = 512 / SR
+    hop = CHROMA_HOP / SR
 
     start = 0
 
@@ -190,39 +387,66 @@ def recognize_chords(wav_path):
 # REALTIME PROCESSING
 # ==========================
 
+decoder = OnlineViterbi()
+
+# created by main() in realtime mode
+chroma_extractor = None
+
 def process_audio_buffer():
 
-    with buffer_lock:
+    # only the newly captured audio is transformed and decoded
+    with stage("hop"):
+
+        chroma = chroma_extractor.push(audio_buffer.read_new())
+
+        if chroma.shape[1] == 0:
+
+            return
+
+        with stage("scoring", frames=chroma.shape[1]):
+
+            emission = compute_emission(normalize_chroma(chroma))
+
+        with stage("decoding", frames=chroma.shape[1]):
+
+            decided = decoder.push(np.log(emission))
 
-        buffer_copy = audio_buffer.copy()
+    if len(decided) > 0:
 
-    with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmp:
+        last = CHORD_LABELS[decided[-1]]
 
-        wav_path = tmp.name
+        print(f"\r🎶 {last:10s}", end="", flush=True)
 
-    sf.write(wav_path, buffer_copy, SR)
+        return last
 
-    try:
+scheduler = hop_scheduler.HopScheduler(process_audio_buffer, HOP_SECONDS)
 
-        chords = recognize_chords(wav_path)
+def warmup():
 
-        if len(chords) > 0:
+    # run the file and realtime paths once on a short dummy chord so the
+    # first hop does not pay for lazy imports and numba compilation
 
-            last = chords[-1][2]
+    start = time.perf_counter()
 
-            print(f"\r🎶 {last:10s}", end="", flush=True)
+    t = np.arange(int(SR * WARMUP_SECONDS)) / SR
 
-    finally:
+    y = (sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3).astype(np.float32)
 
-        os.remove(wav_path)
+    recognize_chords_signal(y, SR)
+
+    chroma = IncrementalChroma(SR, 2048, CHROMA_HOP).push(y)
+
+    OnlineViterbi().push(np.log(compute_emission(normalize_chroma(chroma))))
+
+    print(f"🔥 Warm-up done in {time.perf_counter() - start:.2f} s")
 
 # ==========================
 # FILE MODE
 # ==========================
 
-def process_file(path):
+def process_file(path, force_tuning=False):
 
-    chords = recognize_chords(path)
+    chords = recognize_chords(path, force_tuning)
 
     for start, end, chord in chords:
 
@@ -234,39 +458,73 @@ def process_file(path):
 
 def main():
 
+    global chroma_extractor
+
     parser = argparse.ArgumentParser()
 
     parser.add_argument("--file","-f")
 
+    parser.add_argument("--lag", type=int, default=DECODER_LAG, help="Decision lag in chroma frames")
+
+    parser.add_argument("--warmup", action="store_true", help="Exercise the processing path on a dummy signal before capture starts")
+
+    parser.add_argument("--force-tuning", action="store_true", help="Re-estimate tuning on every call instead of once per file / slowly per stream")
+
+    hop_scheduler.add_arguments(parser)
+
+    instrumentation.add_arguments(parser)
+
     args = parser.parse_args()
 
+    instrumentation.configure(args)
+
     if args.file:
 
-        process_file(args.file)
+        process_file(args.file, args.force_tuning)
+
+        instrumentation.finish(args)
 
         return
 
+    decoder.lag = args.lag
+
+    decoder.reset()
+
     print("🎤 HMM chord recognition realtime")
 
+    import sounddevice as sd
+
+    chroma_extractor = IncrementalChroma(
+        SR, 2048, CHROMA_HOP, tuning=TuningTracker(STREAM_TUNING_RATE, force=args.force_tuning)
+    )
+
+    if args.warmup:
+
+        warmup()
+
+    scheduler.policy = args.policy
+
     with sd.InputStream(
         channels=1,
         samplerate=SR,
         blocksize=HOP_SIZE,
         callback=audio_callback
-    ):
-
-        try:
+    ) as stream:
 
-            while True:
+        scheduler.input_latency = stream.latency
 
-                time.sleep(HOP_SECONDS)
+        try:
 
-                process_audio_buffer()
+            scheduler.run()
 
         except KeyboardInterrupt:
 
             print("\nStopped")
 
+    print(scheduler.format_stats())
+
+    instrumentation.finish(args)
+
 if __name__ == "__main__":
 
     main()
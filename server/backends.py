@@ -0,0 +1,128 @@
+"""
+The recognizers of this repository behind one interface, for the servers.
+
+Each backend wraps an existing entry point: metric/distance/recognition.py
+("metric"), metric/librosa_lib.py ("template"), probabilistic/librosa_lib.py
+("hmm"), neural/main.py ("madmom") and neural/omny.py ("omnizart"). The
+scripts share file names and expect their own directory on sys.path, so
+they are loaded by path under unique module names. All backends return
+(start, end, label) segments with plain Python types.
+"""
+import importlib.util
+import os
+import sys
+import threading
+
+import numpy as np
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WARMUP_SR = 44100
+
+
+def load_script(name, relpath):
+    path = os.path.join(ROOT, relpath)
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def labels_to_segments(labels, hop):
+    # framewise labels -> (start, end, label) runs
+    segments = []
+    start = 0
+    for i in range(1, len(labels) + 1):
+        if i == len(labels) or labels[i] != labels[start]:
+            segments.append((start * hop, i * hop, labels[start]))
+            start = i
+    return segments
+
+
+class Backend:
+    """
+    One recognizer kept loaded for the lifetime of a server.
+
+    Calls into the same backend are serialized: the scripts keep
+    module-level state (models, realtime buffers) that is not meant to
+    be shared between threads. Different backends run concurrently.
+    """
+
+    def __init__(self, name, recognize_file, recognize_signal):
+        self.name = name
+        self._recognize_file = recognize_file
+        self._recognize_signal = recognize_signal
+        self.lock = threading.Lock()
+
+    def recognize_file(self, path):
+        with self.lock:
+            return _as_segments(self._recognize_file(path))
+
+    def recognize_signal(self, y, sr):
+        with self.lock:
+            return _as_segments(self._recognize_signal(np.asarray(y, dtype=np.float32), sr))
+
+    def warmup(self, seconds=2.0):
+        # loads lazily imported modules and models, compiles numba paths
+        t = np.arange(int(WARMUP_SR * seconds)) / WARMUP_SR
+        y = sum(np.sin(2 * np.pi * f * t) for f in (220.0, 277.18, 329.63)) / 3
+        self.recognize_signal(y, WARMUP_SR)
+
+
+def _as_segments(chords):
+    return [(float(start), float(end), str(label)) for start, end, label in chords]
+
+
+def _metric_hop(sr):
+    # frame hop of chromagram_stft
+    return int(sr * 93 / 1000) / sr
+
+
+def load_metric():
+    metric_dir = os.path.join(ROOT, "metric")
+    for path in (ROOT, metric_dir):
+        if path not in sys.path:
+            sys.path.append(path)
+    from distance.recognition import chord_recognition, chord_recognition_from_signal
+
+    return Backend(
+        "metric",
+        lambda path: labels_to_segments(chord_recognition(path), _metric_hop(44100)),
+        lambda y, sr: labels_to_segments(chord_recognition_from_signal(y, sr), _metric_hop(sr)),
+    )
+
+
+def load_template():
+    module = load_script("template_librosa_lib", os.path.join("metric", "librosa_lib.py"))
+    return Backend("template", module.recognize_chords, module.recognize_chords_signal)
+
+
+def load_hmm():
+    module = load_script("hmm_librosa_lib", os.path.join("probabilistic", "librosa_lib.py"))
+    return Backend("hmm", module.recognize_chords, module.recognize_chords_signal)
+
+
+def load_madmom():
+    module = load_script("madmom_main", os.path.join("neural", "main.py"))
+    return Backend("madmom", module.recognize_chords, module.recognize_chords_signal)
+
+
+def load_omnizart():
+    module = load_script("omnizart_omny", os.path.join("neural", "omny.py"))
+    return Backend("omnizart", module.recognize_chords_file, module.recognize_chords_signal)
+
+
+BACKENDS = {
+    "metric": load_metric,
+    "template": load_template,
+    "hmm": load_hmm,
+    "madmom": load_madmom,
+    "omnizart": load_omnizart,
+}
+
+
+def load_backend(name, warmup=True):
+    backend = BACKENDS[name]()
+    if warmup:
+        backend.warmup()
+    return backend
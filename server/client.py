@@ -0,0 +1,86 @@
+"""
+Command-line client for server/daemon.py.
+
+    python server/client.py --backend hmm song.wav other.wav
+    python server/client.py --backend metric --pcm song.wav   # send decoded audio
+    python server/client.py --stats
+"""
+import argparse
+import os
+import socket
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from server.protocol import DEFAULT_PORT, encode, read_message
+
+
+class RecognitionClient:
+
+    def __init__(self, port=DEFAULT_PORT, unix_socket=None):
+        if unix_socket:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(unix_socket)
+        else:
+            self.sock = socket.create_connection(("127.0.0.1", port))
+        self.rfile = self.sock.makefile("rb")
+
+    def request(self, message, pcm=None):
+        self.sock.sendall(encode(message, pcm))
+        response, _ = read_message(self.rfile)
+        if response is None:
+            raise ConnectionError("server closed the connection")
+        return response
+
+    def recognize_file(self, path, backend="metric"):
+        # the daemon may run in another directory
+        return self.request({"backend": backend, "path": os.path.abspath(path)})
+
+    def recognize_signal(self, y, sr, backend="metric"):
+        return self.request({"backend": backend, "sr": sr}, pcm=y)
+
+    def stats(self):
+        return self.request({"op": "stats"})
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("files", nargs="*")
+    parser.add_argument("--backend", "-b", default="metric")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--socket", help="Connect to this Unix socket instead of TCP")
+    parser.add_argument("--pcm", action="store_true", help="Decode locally and send the samples")
+    parser.add_argument("--stats", action="store_true", help="Print the daemon's cache statistics")
+    args = parser.parse_args()
+
+    client = RecognitionClient(args.port, args.socket)
+
+    for path in args.files:
+        if args.pcm:
+            import soundfile as sf
+
+            y, sr = sf.read(path, dtype="float32", always_2d=True)
+            response = client.recognize_signal(y.mean(axis=1), sr, args.backend)
+        else:
+            response = client.recognize_file(path, args.backend)
+
+        if not response["ok"]:
+            print(f"{path}: error: {response['error']}")
+            continue
+
+        print(f"📂 {path} ({response['backend']}, {response['seconds'] * 1000:.0f} ms"
+              f"{', cached' if response['cached'] else ''})")
+        for start, end, label in response["segments"]:
+            print(f"{start:.2f} - {end:.2f}: {label}")
+
+    if args.stats:
+        print(client.stats())
+
+    client.close()
+
+
+if __name__ == "__main__":
+    main()
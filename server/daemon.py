@@ -0,0 +1,219 @@
+"""
+Long-running recognition daemon.
+
+Keeps the requested backends loaded (and warmed up) and answers requests
+on a localhost TCP port or a Unix socket, so a recognition does not pay
+for interpreter start, imports and model loading:
+
+    python server/daemon.py --port 8765 --backends metric hmm madmom
+    python server/client.py --backend hmm song.wav
+
+Requests (see server/protocol.py) are
+
+    {"backend": "hmm", "path": "/abs/song.wav"}
+    {"backend": "metric", "sr": 22050, "pcm_bytes": N} + N bytes of float32
+    {"op": "stats"}
+
+and are answered with {"ok": true, "segments": [[start, end, label], ...],
+"cached": bool, "seconds": float} or {"ok": false, "error": "..."}.
+Results are kept in an LRU cache keyed by a hash of the audio contents
+and the backend, so repeated requests are not recomputed.
+"""
+import argparse
+import hashlib
+import os
+import socketserver
+import sys
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from server.backends import BACKENDS, load_backend
+from server.protocol import DEFAULT_PORT, encode, read_message
+
+
+class ResultCache:
+    """
+    In-memory LRU of recognition results, keyed by content hash.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._file_hashes = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self._entries),
+        }
+
+    def file_key(self, backend, path):
+        stat = os.stat(path)
+        # the file is only rehashed when it changes on disk
+        ident = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            digest = self._file_hashes.get(ident)
+            if digest is not None:
+                self._file_hashes.move_to_end(ident)
+        if digest is None:
+            h = hashlib.sha1()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    h.update(block)
+            digest = h.hexdigest()
+            with self._lock:
+                self._file_hashes[ident] = digest
+                while len(self._file_hashes) > self.max_entries:
+                    self._file_hashes.popitem(last=False)
+        return f"{backend}:file:{digest}"
+
+    def pcm_key(self, backend, pcm, sr):
+        return f"{backend}:pcm:{sr}:{hashlib.sha1(pcm.tobytes()).hexdigest()}"
+
+    def get_or_compute(self, key, compute):
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key], True
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return value, False
+
+
+class RecognitionDaemon:
+
+    def __init__(self, backends, cache_size=1024, warmup=True):
+        self.cache = ResultCache(cache_size)
+        self.backends = {}
+        self.requests = 0
+
+        for name in backends:
+            start = time.perf_counter()
+            try:
+                self.backends[name] = load_backend(name, warmup=warmup)
+            except Exception as e:
+                # optional dependencies (madmom, omnizart) may be missing
+                print(f"⚠️  backend {name} unavailable: {type(e).__name__}: {e}")
+                continue
+            print(f"✅ backend {name} loaded in {time.perf_counter() - start:.2f} s")
+
+    def handle(self, request, pcm):
+        self.requests += 1
+
+        if request.get("op", "recognize") == "stats":
+            return {
+                "ok": True,
+                "backends": sorted(self.backends),
+                "requests": self.requests,
+                "cache": self.cache.stats,
+            }
+
+        name = request.get("backend", "metric")
+        backend = self.backends.get(name)
+        if backend is None:
+            return {"ok": False, "error": f"backend {name!r} is not loaded, available: {sorted(self.backends)}"}
+
+        start = time.perf_counter()
+        if pcm is not None:
+            sr = int(request.get("sr", 44100))
+            key = self.cache.pcm_key(name, pcm, sr)
+            segments, cached = self.cache.get_or_compute(key, lambda: backend.recognize_signal(pcm, sr))
+        else:
+            path = request["path"]
+            key = self.cache.file_key(name, path)
+            segments, cached = self.cache.get_or_compute(key, lambda: backend.recognize_file(path))
+
+        return {
+            "ok": True,
+            "backend": name,
+            "cached": cached,
+            "seconds": time.perf_counter() - start,
+            "segments": segments,
+        }
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        # any number of requests per connection, answered in order
+        while True:
+            try:
+                request, pcm = read_message(self.rfile)
+                if request is None:
+                    return
+                response = self.server.daemon.handle(request, pcm)
+            except EOFError:
+                return
+            except Exception as e:
+                traceback.print_exc()
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+
+            self.wfile.write(encode(response))
+            self.wfile.flush()
+
+
+class TCPServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if hasattr(socketserver, "ThreadingUnixStreamServer"):
+
+    class UnixServer(socketserver.ThreadingUnixStreamServer):
+        daemon_threads = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Listen on 127.0.0.1:PORT")
+    parser.add_argument("--socket", help="Listen on this Unix socket instead of TCP")
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS), default=list(BACKENDS))
+    parser.add_argument("--cache-size", type=int, default=1024, help="Cached results (LRU)")
+    parser.add_argument("--no-warmup", action="store_true", help="Skip the dummy run after loading a backend")
+    args = parser.parse_args()
+
+    daemon = RecognitionDaemon(args.backends, args.cache_size, warmup=not args.no_warmup)
+    if not daemon.backends:
+        sys.exit("No backend could be loaded")
+
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixServer(args.socket, RequestHandler)
+        address = args.socket
+    else:
+        server = TCPServer(("127.0.0.1", args.port), RequestHandler)
+        address = f"127.0.0.1:{args.port}"
+
+    server.daemon = daemon
+
+    print(f"🎧 Serving {', '.join(sorted(daemon.backends))} on {address} (Ctrl+C to exit)")
+    with server:
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            print("\n🛑 Stopped.")
+        finally:
+            if args.socket and os.path.exists(args.socket):
+                os.remove(args.socket)
+
+
+if __name__ == "__main__":
+    main()
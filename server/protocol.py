@@ -0,0 +1,60 @@
+"""
+Wire format shared by the servers and their clients.
+
+A message is one line of UTF-8 JSON. A request that carries audio sets
+"pcm_bytes": N in its header, and exactly N bytes of little-endian
+float32 mono samples follow the newline.
+"""
+import asyncio
+import json
+
+import numpy as np
+
+PCM_DTYPE = "<f4"
+
+DEFAULT_PORT = 8765
+STREAM_PORT = 8766
+
+
+def encode(message, pcm=None):
+    if pcm is not None:
+        pcm = np.ascontiguousarray(pcm, dtype=PCM_DTYPE).tobytes()
+        message = dict(message, pcm_bytes=len(pcm))
+    data = (json.dumps(message) + "\n").encode()
+    return data + pcm if pcm is not None else data
+
+
+def read_message(rfile):
+    """
+    Read one message from a binary file object; returns (message, pcm)
+    or (None, None) at end of stream. pcm is a float32 array or None.
+    """
+    line = rfile.readline()
+    if not line:
+        return None, None
+    message = json.loads(line)
+    pcm = None
+    if "pcm_bytes" in message:
+        data = rfile.read(message["pcm_bytes"])
+        if len(data) != message["pcm_bytes"]:
+            raise EOFError("connection closed inside a PCM payload")
+        pcm = np.frombuffer(data, dtype=PCM_DTYPE)
+    return message, pcm
+
+
+async def read_message_async(reader):
+    """
+    read_message() for an asyncio StreamReader.
+    """
+    line = await reader.readline()
+    if not line:
+        return None, None
+    message = json.loads(line)
+    pcm = None
+    if "pcm_bytes" in message:
+        try:
+            data = await reader.readexactly(message["pcm_bytes"])
+        except asyncio.IncompleteReadError:
+            raise EOFError("connection closed inside a PCM payload")
+        pcm = np.frombuffer(data, dtype=PCM_DTYPE)
+    return message, pcm
@@ -0,0 +1,103 @@
+"""
+Test client for server/streaming.py.
+
+Streams an audio file as one or more concurrent sessions, in blocks,
+either paced like a live input or as fast as the server accepts it, and
+prints the chord changes pushed back (for the first stream) plus a
+throughput summary:
+
+    python server/stream_client.py song.wav --backend hmm
+    python server/stream_client.py song.wav --streams 48 --fast
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from server.protocol import STREAM_PORT, encode, read_message_async
+
+
+async def run_stream(y, sr, args, verbose):
+    reader, writer = await asyncio.open_connection(args.host, args.port)
+
+    writer.write(encode({"op": "start", "backend": args.backend, "sr": sr}))
+    started, _ = await read_message_async(reader)
+    if started.get("event") != "started":
+        raise RuntimeError(started.get("error", started))
+
+    async def send():
+        block = int(sr * args.block)
+        start = time.perf_counter()
+        for i in range(0, len(y), block):
+            writer.write(encode({}, pcm=y[i:i + block]))
+            await writer.drain()
+            if not args.fast:
+                # pace like a live input
+                delay = start + (i + block) / sr - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+        writer.write(encode({"op": "end"}))
+        await writer.drain()
+
+    sender = asyncio.ensure_future(send())
+    changes = 0
+    while True:
+        message, _ = await read_message_async(reader)
+        if message is None:
+            raise ConnectionError("server closed the connection")
+        if message["event"] == "chord":
+            changes += 1
+            if verbose:
+                print(f"{message['time']:8.2f}: {message['label']}")
+        elif message["event"] == "end":
+            break
+
+    await sender
+    writer.close()
+    message["changes"] = changes
+    return message
+
+
+async def run(args):
+    import soundfile as sf
+
+    y, sr = sf.read(args.file, dtype="float32", always_2d=True)
+    y = np.ascontiguousarray(y.mean(axis=1))
+
+    start = time.perf_counter()
+    results = await asyncio.gather(*(
+        run_stream(y, sr, args, verbose=(i == 0 and not args.quiet))
+        for i in range(args.streams)
+    ))
+    wall = time.perf_counter() - start
+
+    compute = sum(r["compute_seconds"] for r in results)
+    dropped = sum(r["overwritten"] for r in results) / sr
+    # with --fast the server drops what does not fit its ring buffers
+    analyzed = len(y) / sr * args.streams - dropped
+    print(f"\n{args.streams} streams x {len(y) / sr:.1f} s ({args.backend}): wall {wall:.2f} s, "
+          f"server compute {compute:.2f} s ({analyzed / max(compute, 1e-9):.0f}x realtime per thread), "
+          f"{dropped:.1f} s of audio dropped")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file")
+    parser.add_argument("--backend", "-b", default="metric")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=STREAM_PORT)
+    parser.add_argument("--streams", "-n", type=int, default=1, help="Concurrent sessions")
+    parser.add_argument("--block", type=float, default=0.1, help="Block length in seconds")
+    parser.add_argument("--fast", action="store_true", help="Send as fast as possible instead of in real time")
+    parser.add_argument("--quiet", "-q", action="store_true", help="Do not print the chord changes")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
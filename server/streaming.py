@@ -0,0 +1,371 @@
+"""
+Asyncio server for many concurrent realtime chord streams.
+
+Every TCP connection is one stream (framing in server/protocol.py):
+
+    -> {"op": "start", "backend": "metric" | "hmm", "sr": 22050}
+    <- {"event": "started", "session": 1, "hop": 0.023}
+    -> {"pcm_bytes": N} + N bytes of float32 samples      (any number)
+    <- {"event": "chord", "time": 12.3, "label": "A:min"}  (on every change)
+    -> {"op": "end"}
+    <- {"event": "end", "frames": ..., "overwritten": ..., ...}
+
+Each session keeps its own RingBuffer, IncrementalChroma (with a slowly
+updated tuning estimate) and causal filter / online Viterbi state, i.e.
+the realtime path of metric/main.py or probabilistic/librosa_lib.py.
+Incoming audio is written to the ring buffer on the event loop. Sessions
+with new audio are collected into batches of up to batch_size per
+backend, and each batch is one job in a thread pool: chroma per session,
+one template scoring call for the new frames of the whole batch, then
+decoding with each session's own state. A session is in at most one job
+at a time; one that falls behind simply processes larger blocks, and
+audio older than the ring buffer is dropped and counted. The chroma
+extractor restarts after a drop, so no frame spans the gap.
+
+    python server/streaming.py --port 8766
+    python server/stream_client.py song.wav --backend hmm --streams 32
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import sys
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "metric"))
+from common.chroma import STREAM_TUNING_RATE, IncrementalChroma, TuningTracker
+from common.ring_buffer import RingBuffer
+from distance.recognition import (
+    CausalMedianFilter,
+    compute_distance_matrices,
+    decode_chords,
+    get_template_bank
+)
+from server.backends import load_script
+from server.protocol import STREAM_PORT, encode, read_message_async
+
+
+@lru_cache(maxsize=None)
+def hmm_module():
+    return load_script("hmm_librosa_lib", os.path.join("probabilistic", "librosa_lib.py"))
+
+
+class MetricStreamDecoder:
+    """
+    Realtime path of metric/main.py: STFT chroma (753 ms frames, 93 ms
+    hop), Euclidean template scoring and a causal median filter.
+
+    features() and decode() hold the per-stream state; score() is
+    stateless and takes the features of many streams at once.
+    """
+
+    def __init__(self, sr):
+        self.hop_length = int(sr * 93 / 1000)
+        self.chroma = IncrementalChroma(
+            sr, int(sr * 753 / 1000), self.hop_length, tuning=TuningTracker(STREAM_TUNING_RATE)
+        )
+        self.median = CausalMedianFilter(17)
+        self.labels = get_template_bank("majmin", num_harmonics=1).labels
+
+    def features(self, samples):
+        C = self.chroma.push(samples)
+        C /= np.maximum(C.sum(axis=0, keepdims=True), 1e-12)
+        return C
+
+    @staticmethod
+    def score(features):
+        bank = get_template_bank("majmin", num_harmonics=1)
+        return compute_distance_matrices(features, bank.matrix, "EUC", sq_norms=bank.sq_norms)
+
+    def decode(self, D):
+        if D.shape[1] == 0:
+            return []
+        return decode_chords(self.median.process(D))
+
+    def flush(self):
+        return []
+
+
+class HMMStreamDecoder:
+    """
+    Realtime path of probabilistic/librosa_lib.py: chroma, softmax
+    emissions and the fixed-lag online Viterbi decoder. The analysis
+    window and hop are scaled to the stream's sample rate.
+    """
+
+    def __init__(self, sr):
+        self.hmm = hmm_module()
+
+        scale = sr / self.hmm.SR
+        self.hop_length = int(round(self.hmm.CHROMA_HOP * scale))
+        self.chroma = IncrementalChroma(
+            sr, int(round(2048 * scale)), self.hop_length, tuning=TuningTracker(STREAM_TUNING_RATE)
+        )
+        self.decoder = self.hmm.OnlineViterbi()
+        self.labels = self.hmm.CHORD_LABELS
+
+    def features(self, samples):
+        return self.hmm.normalize_chroma(self.chroma.push(samples))
+
+    @staticmethod
+    def score(features):
+        return hmm_module().compute_emissions(features)
+
+    def decode(self, emission):
+        if len(emission) == 0:
+            return []
+        return self.decoder.push(np.log(emission))
+
+    def flush(self):
+        return self.decoder.flush()
+
+
+DECODERS = {
+    "metric": MetricStreamDecoder,
+    "hmm": HMMStreamDecoder,
+}
+
+
+class StreamSession:
+
+    def __init__(self, session_id, backend, sr, buffer_seconds, writer):
+        self.id = session_id
+        self.backend = backend
+        self.sr = sr
+        self.decoder = DECODERS[backend](sr)
+        self.buffer = RingBuffer(int(sr * buffer_seconds))
+        self.writer = writer
+
+        self.frames = 0
+        self.received = 0        # samples given to the extractor
+        self.skipped = 0         # samples dropped by the ring buffer
+        self.segments = [(0, 0)]  # (first frame, its sample) per gap-free run
+        self.label = None
+        self.busy = False      # inside an analysis job
+        self.pending = False   # has audio no job has taken yet
+        self.idle = asyncio.Event()
+        self.compute_seconds = 0.0
+
+    def finish(self):
+        return self.changes(self.decoder.flush())
+
+    def features(self, samples, skipped):
+        """
+        Features of the next block; skipped is the number of samples
+        dropped by the ring buffer so far. After a drop the extractor
+        starts over, and its frames are timed from the end of the gap.
+        """
+        if skipped > self.skipped:
+            chroma = self.decoder.chroma
+            self.segments.append((self.segments[-1][0] + chroma.frames, self.received + skipped))
+            chroma.reset()
+            self.skipped = skipped
+        self.received += len(samples)
+        return self.decoder.features(samples)
+
+    def changes(self, indices):
+        """
+        (time, label) chord changes among the newly decided frames.
+        """
+        changes = []
+        for i in indices:
+            label = self.decoder.labels[i]
+            if label != self.label:
+                while len(self.segments) > 1 and self.segments[1][0] <= self.frames:
+                    self.segments.pop(0)
+                first, sample = self.segments[0]
+                seconds = (sample + (self.frames - first) * self.decoder.hop_length) / self.sr
+                changes.append((seconds, label))
+                self.label = label
+            self.frames += 1
+        return changes
+
+
+def analyze_batch(sessions, blocks, skipped):
+    """
+    Runs in the executor: new audio of sessions of one backend ->
+    chord changes per session, with a single scoring call for all.
+    """
+    start = time.perf_counter()
+
+    features = [s.features(samples, n) for s, samples, n in zip(sessions, blocks, skipped)]
+    scores = DECODERS[sessions[0].backend].score(features)
+    changes = [s.changes(s.decoder.decode(score)) for s, score in zip(sessions, scores)]
+
+    elapsed = (time.perf_counter() - start) / len(sessions)
+    for s in sessions:
+        s.compute_seconds += elapsed
+    return changes
+
+
+class StreamingServer:
+
+    def __init__(self, workers=None, buffer_seconds=4.0, batch_size=64):
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count())
+        self.buffer_seconds = buffer_seconds
+        self.batch_size = batch_size
+        self.session_ids = itertools.count(1)
+        self.active = 0
+
+        # sessions with new audio and no job, per backend
+        self.ready = {backend: set() for backend in DECODERS}
+        self.wakeup = asyncio.Event()
+        self.batches = 0
+        self.jobs = set()
+
+    async def handle(self, reader, writer):
+        try:
+            header, _ = await read_message_async(reader)
+            if header is None:
+                return
+
+            backend = header.get("backend", "metric")
+            if backend not in DECODERS:
+                writer.write(encode({"event": "error", "error": f"unknown backend {backend!r}, expected one of {sorted(DECODERS)}"}))
+                await writer.drain()
+                return
+
+            session = StreamSession(
+                next(self.session_ids), backend, int(header.get("sr", 44100)), self.buffer_seconds, writer
+            )
+            self.active += 1
+
+            try:
+                await self._serve_session(session, reader)
+            finally:
+                self.active -= 1
+                self.ready[backend].discard(session)
+
+        except (EOFError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def _serve_session(self, session, reader):
+        writer = session.writer
+        writer.write(encode({
+            "event": "started",
+            "session": session.id,
+            "hop": session.decoder.hop_length / session.sr,
+        }))
+        await writer.drain()
+
+        while True:
+            message, pcm = await read_message_async(reader)
+            if message is None or message.get("op") == "end":
+                break
+
+            if pcm is not None and len(pcm):
+                session.buffer.write(pcm)
+                session.pending = True
+                if not session.busy:
+                    self.ready[session.backend].add(session)
+                    self.wakeup.set()
+
+        # wait until everything received has been analyzed
+        while session.busy or session.pending:
+            session.idle.clear()
+            await session.idle.wait()
+
+        loop = asyncio.get_running_loop()
+        changes = await loop.run_in_executor(self.executor, session.finish)
+        self._send_changes(writer, changes)
+
+        writer.write(encode({
+            "event": "end",
+            "frames": session.frames,
+            "overwritten": session.buffer.overwritten,
+            "compute_seconds": session.compute_seconds,
+        }))
+        await writer.drain()
+
+    async def dispatch(self):
+        # forms batches from the ready sessions whenever audio arrives
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            for ready in self.ready.values():
+                sessions = list(ready)
+                ready.clear()
+                # mark the sessions before the job is scheduled, so audio
+                # arriving until it starts cannot queue them a second time
+                for s in sessions:
+                    s.busy = True
+                    s.pending = False
+                for i in range(0, len(sessions), self.batch_size):
+                    job = asyncio.ensure_future(self._analyze(sessions[i:i + self.batch_size]))
+                    # the loop keeps only weak references to tasks
+                    self.jobs.add(job)
+                    job.add_done_callback(self.jobs.discard)
+
+    async def _analyze(self, sessions):
+        loop = asyncio.get_running_loop()
+
+        blocks = [s.buffer.read_new() for s in sessions]
+        skipped = [s.buffer.overwritten for s in sessions]
+
+        try:
+            changes = await loop.run_in_executor(self.executor, analyze_batch, sessions, blocks, skipped)
+            self.batches += 1
+        except Exception:
+            traceback.print_exc()
+            changes = [[] for _ in sessions]
+
+        for s, session_changes in zip(sessions, changes):
+            self._send_changes(s.writer, session_changes)
+            s.busy = False
+            # audio that arrived during the job goes into the next batch
+            if s.pending:
+                self.ready[s.backend].add(s)
+                self.wakeup.set()
+            s.idle.set()
+
+        for s in sessions:
+            try:
+                await s.writer.drain()
+            except ConnectionError:
+                pass
+
+    def _send_changes(self, writer, changes):
+        for seconds, label in changes:
+            writer.write(encode({"event": "chord", "time": seconds, "label": label}))
+
+
+async def serve(host, port, workers, buffer_seconds, batch_size):
+    server = StreamingServer(workers, buffer_seconds, batch_size)
+    # keep a reference: the loop holds tasks only weakly
+    dispatch = asyncio.ensure_future(server.dispatch())
+    tcp_server = await asyncio.start_server(server.handle, host, port)
+
+    print(f"🎧 Streaming {', '.join(sorted(DECODERS))} on {host}:{port} (Ctrl+C to exit)")
+    async with tcp_server:
+        await tcp_server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=STREAM_PORT)
+    parser.add_argument("--workers", "-j", type=int, default=os.cpu_count(),
+                        help="Analysis threads shared by all sessions")
+    parser.add_argument("--buffer-seconds", type=float, default=4.0,
+                        help="Per-session ring buffer; older unanalyzed audio is dropped")
+    parser.add_argument("--batch-size", type=int, default=64,
+                        help="Maximum number of sessions scored together in one job")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, args.buffer_seconds, args.batch_size))
+    except KeyboardInterrupt:
+        print("\n🛑 Stopped.")
+
+
+if __name__ == "__main__":
+    main()
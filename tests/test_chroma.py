@@ -0,0 +1,30 @@
+import os
+import sys
+
+import librosa
+import numpy as np
+import pytest
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from common.chroma import TuningTracker
+
+SR = 22050
+
+
+def detuned_chord(tuning, seconds=3.0, seed=0):
+    # C major triad shifted by `tuning` semitones, plus a little noise
+    t = np.arange(int(SR * seconds)) / SR
+    y = sum(
+        np.sin(2 * np.pi * librosa.midi_to_hz(note + tuning) * t)
+        for note in (60, 64, 67, 72)
+    )
+    rng = np.random.default_rng(seed)
+    return (y / 4 + 0.01 * rng.standard_normal(len(t))).astype(np.float32)
+
+
+@pytest.mark.parametrize("tuning", [0.0, 0.02, 0.23, -0.27, 0.41])
+def test_update_from_signal_matches_librosa(tuning):
+    y = detuned_chord(tuning)
+    assert TuningTracker().update_from_signal(y, SR) == pytest.approx(
+        librosa.estimate_tuning(y=y, sr=SR)
+    )
@@ -0,0 +1,59 @@
+import asyncio
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from server.protocol import encode, read_message_async
+from server.streaming import StreamingServer
+
+SR = 22050
+
+
+async def run_stream(port, y, block):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(encode({"op": "start", "backend": "metric", "sr": SR}))
+    await read_message_async(reader)
+
+    for i in range(0, len(y), block):
+        writer.write(encode({}, pcm=y[i:i + block]))
+        await writer.drain()
+    writer.write(encode({"op": "end"}))
+    await writer.drain()
+
+    while True:
+        message, _ = await read_message_async(reader)
+        if message["event"] == "end":
+            writer.close()
+            return message
+
+
+async def run_streams(n_streams, seconds):
+    server = StreamingServer(workers=4, buffer_seconds=2 * seconds, batch_size=4)
+    dispatch = asyncio.ensure_future(server.dispatch())
+    tcp_server = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+    port = tcp_server.sockets[0].getsockname()[1]
+
+    rng = np.random.default_rng(0)
+    y = rng.standard_normal(int(SR * seconds)).astype(np.float32)
+    try:
+        return await asyncio.gather(*(
+            run_stream(port, y, int(SR * 0.1)) for _ in range(n_streams)
+        ))
+    finally:
+        dispatch.cancel()
+        tcp_server.close()
+        server.executor.shutdown()
+
+
+def test_concurrent_streams_get_every_frame():
+    seconds = 10
+    results = asyncio.run(run_streams(12, seconds))
+
+    # MetricStreamDecoder: 753 ms frames, 93 ms hop, no centering
+    n_fft, hop = int(SR * 753 / 1000), int(SR * 93 / 1000)
+    expected = 1 + (SR * seconds - n_fft) // hop
+
+    assert [r["overwritten"] for r in results] == [0] * 12
+    assert [r["frames"] for r in results] == [expected] * 12